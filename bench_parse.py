@@ -0,0 +1,146 @@
+"""
+Benchmark the extraction of table data from the pages in raw/site, comparing the current
+implementation in `cldfbench_uclaphoneticslabarchive` with the original XPath-based one.
+
+    python bench_parse.py [--repeat 3]
+
+The digests of the rows extracted from each page by the original implementation are stored in
+test_data/parsed_pages.json, so `test_parsed_pages` in test.py can check that the current
+implementation yields the same rows. To re-create the file, run
+
+    python bench_parse.py --expectations test_data/parsed_pages.json
+"""
+import json
+import time
+import hashlib
+import pathlib
+import argparse
+
+import lxml.html
+
+import cldfbench_uclaphoneticslabarchive as current
+
+SITE = pathlib.Path(__file__).parent / 'raw' / 'site'
+
+
+#
+# The original implementation:
+#
+def iter_tables(doc):
+    def norm(d):
+        for k in ['Zulu', 'Hindi', 'Armenian', 'Haiǀǀom', 'Language:']:
+            if k in d:
+                assert 'Language' not in d
+                d['Language'] = d.pop(k)
+        for k in ['Tiff Image', 'Tiff Image 2']:
+            if k in d:
+                d[k.replace('Tiff', 'TIFF')] = d.pop(k)
+        return d
+
+    def extract(key, value):
+        key = ''.join(key.itertext()).strip()
+        if key == 'Rights of Access':
+            value = value.xpath('a')[0].attrib['href']
+        else:
+            value = ''.join(value.itertext()).strip()
+        return key, value
+
+    for i, table in enumerate(doc.xpath('.//table'), start=1):
+        md = dict(extract(*tr.xpath('td')) for tr in table.xpath('tr'))
+        assert int(md['Recording']) == i
+        yield i, norm(md)
+
+
+def iter_trs(doc, fname):
+    def extract(td, sep='\n'):
+        links = td.xpath('a')
+        if links and 'href' in links[0].attrib:
+            assert len(links) == 1
+            return links[0].attrib['href'], links[0].text
+        if td.xpath('div'):
+            return td.xpath('div')[0].text.strip()
+        return sep.join(td.itertext()).strip()
+
+    tables = list(doc.xpath('.//table'))
+    header = None
+    for i, tr in enumerate(tables[-1].xpath('.//tr')):
+        if not i:
+            header = [
+                ' '.join((extract(e, sep='') or str(i + 1)).split())
+                for i, e in enumerate(tr.xpath('th'))]
+        else:
+            row = [extract(td) for td in tr.xpath('td')]
+            if fname in ['hye_word-list_1973_01.html', 'hye_word-list_1983_01.html']:
+                # four columns are stuffed into two
+                assert len(row) == 2
+                row = [r.strip() for r in (row[0].split('\xa0') + row[1].split('\xa0'))[:4]]
+            if len(row) < len(header):
+                row += ['' for _ in range(len(header) - len(row))]
+            yield i, dict(zip(header, row))
+
+
+def doc(p):
+    # There are corrupted HTML files:
+    return lxml.html.fromstring(p.read_text(encoding='utf8').replace('<t/d>', '</td>'))
+
+
+ORIGINAL = (doc, iter_tables, iter_trs)
+CURRENT = (current.doc, current.iter_tables, current.iter_trs)
+
+
+def pages():
+    return sorted(p for p in SITE.glob('*/*.html'))
+
+
+def page_rows(p, impl=CURRENT):
+    """
+    :return: `list` of the rows extracted from a page - `(i, dict)` pairs for record details \
+    pages and pages with word lists.
+    """
+    doc_, iter_tables_, iter_trs_ = impl
+    if p.name.endswith('_record_details.html'):
+        return list(iter_tables_(doc_(p)))
+    return list(iter_trs_(doc_(p), None if p.name == 'index.html' else p.name))
+
+
+def digest(p, impl=CURRENT):
+    """
+    :return: SHA256 digest of the JSON serialized rows of a page.
+    """
+    return hashlib.sha256(
+        json.dumps(page_rows(p, impl), ensure_ascii=False).encode('utf8')).hexdigest()
+
+
+def timed(impl, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for p in pages():
+            page_rows(p, impl)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--expectations', type=pathlib.Path, default=None)
+    args = parser.parse_args()
+
+    if args.expectations:
+        args.expectations.parent.mkdir(exist_ok=True)
+        args.expectations.write_text(json.dumps(
+            {p.relative_to(SITE).as_posix(): digest(p, ORIGINAL) for p in pages()},
+            indent=0,
+            sort_keys=True), encoding='utf8')
+        return
+
+    different = [p for p in pages() if digest(p, ORIGINAL) != digest(p)]
+    original, new = timed(ORIGINAL, args.repeat), timed(CURRENT, args.repeat)
+    print('{} pages, {} with different rows'.format(len(pages()), len(different)))
+    print('original: {:.2f}s, current: {:.2f}s, speedup: {:.1f}x'.format(
+        original, new, original / new))
+
+
+if __name__ == '__main__':
+    main()
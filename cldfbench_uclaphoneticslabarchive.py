@@ -4,20 +4,36 @@ This module implements the conversion of the HTML pages of the UCLA phonetics la
 Sprinkled throughout are comments indicating fixes of the inconsistencies encountered in the
 web site's files.
 """
+import os
 import re
+import json
+import time
+import shutil
+import sqlite3
+import decimal
+import hashlib
+import inspect
 import pathlib
+import cProfile
 import argparse
+import functools
+import contextlib
+import tracemalloc
+import threading
 import mimetypes
 import collections
+import http.client
+import http.server
+import urllib.error
 import urllib.parse
-import urllib.request
+import concurrent.futures
 
-import lxml.html
+import lxml.etree
 from csvw.metadata import URITemplate
 from clldutils.jsonlib import dump, load
 from clldutils.misc import slug
 from clldutils.markup import add_markdown_text
-from cldfbench import Dataset as BaseDataset, CLDFSpec
+from cldfbench import Dataset as BaseDataset, CLDFSpec, CLDFWriter
 
 BASE_URL = "http://archive.phonetics.ucla.edu/"
 GLOTTOCODES = {
@@ -32,6 +48,527 @@ GLOTTOCODES = {
 }
 
 
+def env(name, default=None, type_=str):
+    """
+    `cldfbench download` and `cldfbench makecldf` do not accept dataset-specific options. Thus,
+    such options are read from environment variables `UCLA_<NAME>`.
+    """
+    res = os.environ.get('UCLA_' + name)
+    if res is None:
+        return default
+    if type_ is bool:
+        return res.lower() not in ['', '0', 'false', 'no']
+    return type_(res)
+
+
+def code_digest(*objs):
+    """
+    :return: SHA256 digest of the source code of functions and classes - used to invalidate data \
+    cached from their output, but not upon changes to unrelated code.
+    """
+    return hashlib.sha256(
+        ''.join(inspect.getsource(obj) for obj in objs).encode('utf8')).hexdigest()
+
+
+class Profiler:
+    """
+    Records wall time, number of calls and peak memory of the stages of a build - in total and per
+    language directory.
+
+    Peak memory is the maximum of the memory allocated by Python, as traced by `tracemalloc`, and is
+    only recorded for stages running in the main thread. Stages running in threads - such as
+    fetching pages - are recorded with the sum of the time spent in all threads.
+    """
+    def __init__(self, enabled=False, cprofile=False):
+        self.enabled = enabled
+        self.cprofile = cprofile
+        self.stages = collections.OrderedDict()
+        self.languages = collections.defaultdict(collections.OrderedDict)
+        self._lock = threading.Lock()
+        self._peaks = []
+
+    def record(self, name, seconds, language=None, peak_memory=None):
+        if not self.enabled:
+            return
+        with self._lock:
+            for stages in [self.stages] + ([self.languages[language]] if language else []):
+                stage = stages.setdefault(name, dict(calls=0, time=0.0, peak_memory=None))
+                stage['calls'] += 1
+                stage['time'] += seconds
+                if peak_memory is not None:
+                    stage['peak_memory'] = max(stage['peak_memory'] or 0, peak_memory)
+
+    @contextlib.contextmanager
+    def stage(self, name, language=None):
+        if not self.enabled:
+            yield
+            return
+        trace = tracemalloc.is_tracing() and threading.current_thread() is threading.main_thread()
+        if trace:
+            # Stages may be nested, so the peak of the enclosing stage must be saved before
+            # resetting the peak for this one.
+            current, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self._peaks.append(current)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds, peak = time.perf_counter() - start, None
+            if trace:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+            self.record(name, seconds, language=language, peak_memory=peak)
+
+    @contextlib.contextmanager
+    def run(self, command, path, log):
+        """
+        Profile a command, writing the report to `<path>.json` - and cProfile stats to
+        `<path>.pstats`, if requested.
+        """
+        if not self.enabled:
+            yield
+            return
+        tracemalloc.start()
+        profile = cProfile.Profile() if self.cprofile else None
+        if profile:
+            profile.enable()
+        try:
+            with self.stage(command):
+                yield
+        finally:
+            if profile:
+                profile.disable()
+                profile.dump_stats(str(path.parent / '{}.pstats'.format(path.name)))
+            tracemalloc.stop()
+            dump(
+                dict(
+                    command=command,
+                    date=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    stages=self.stages,
+                    languages=self.languages),
+                path.parent / '{}.json'.format(path.name),
+                indent=2)
+            log.info('Profile of {} written to {}.json'.format(command, path))
+
+
+class Writer(CLDFWriter):
+    """
+    A `CLDFWriter` profiling the writing of the CLDF data.
+    """
+    def write(self, **kw):
+        with self.dataset.profiler.stage('write'):
+            return super().write(**kw)
+
+
+class Fetcher:
+    """
+    Fetches URLs from a thread pool, re-using HTTP connections.
+
+    Each worker thread keeps one keep-alive connection per host, thus the number of concurrent
+    connections to a host is bounded by the number of workers. Failed requests are retried with
+    exponential backoff.
+    """
+    def __init__(self, workers=8, retries=4, backoff=1.0, timeout=60):
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def _connections(self):
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+        return self._local.connections
+
+    def _reset(self):
+        for conn in self._connections.values():
+            conn.close()
+        self._connections.clear()
+
+    def request(self, url, headers=None, method='GET'):
+        """
+        Send a request, following redirects.
+
+        :return: `http.client.HTTPResponse` - which must be read completely before the next \
+        request is sent from the same thread.
+        :raises urllib.error.HTTPError: for responses with status >= 400.
+        """
+        for _ in range(5):
+            parsed = urllib.parse.urlsplit(url)
+            key = (parsed.scheme, parsed.netloc)
+            if key not in self._connections:
+                cls = http.client.HTTPSConnection if parsed.scheme == 'https' \
+                    else http.client.HTTPConnection
+                self._connections[key] = cls(parsed.netloc, timeout=self.timeout)
+            self._connections[key].request(
+                method,
+                urllib.parse.urlunsplit(('', '', parsed.path or '/', parsed.query, '')),
+                headers=headers or {})
+            res = self._connections[key].getresponse()
+            if res.status in {301, 302, 303, 307, 308}:
+                res.read()
+                url = urllib.parse.urljoin(url, res.getheader('Location'))
+                continue
+            if res.status >= 400:
+                res.read()
+                raise urllib.error.HTTPError(url, res.status, res.reason, res.headers, None)
+            return res
+        raise urllib.error.URLError('Too many redirects: {}'.format(url))
+
+    def retry(self, func, *args):
+        """
+        Call `func`, retrying on network errors and server errors.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args)
+            except urllib.error.HTTPError as e:
+                self._reset()
+                if (e.code < 500 and e.code != 429) or attempt == self.retries:
+                    raise
+            except (OSError, http.client.HTTPException):
+                self._reset()
+                if attempt == self.retries:
+                    raise
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def fetch(self, url, target, headers=None):
+        """
+        Download `url` to `target`.
+
+        The content is written to a temporary file first, which is renamed upon completion. Thus,
+        `target` only exists if the download was complete.
+        """
+        def get():
+            res = self.request(url, headers=headers)
+            if res.status == 304:  # Not modified.
+                res.read()
+                return res
+            tmp = target.parent / '{}.tmp'.format(target.name)
+            with tmp.open('wb') as f:
+                shutil.copyfileobj(res, f, 64 * 1024)
+            os.replace(tmp, target)
+            return res
+        return self.retry(get)
+
+    def read_range(self, url, start, end):
+        """
+        Read the bytes from `start` to `end` (inclusive) of the resource at `url`.
+
+        :return: `tuple` of the `bytes` read and the total size of the resource (or `None` if the \
+        server doesn't tell).
+        """
+        def get():
+            res = self.request(url, headers={'Range': 'bytes={}-{}'.format(start, end)})
+            if res.status == 206:
+                total = (res.getheader('Content-Range') or '').partition('/')[2]
+                return res.read(), int(total) if total.isdigit() else None
+            # The server ignored the Range header. We only read what we need and drop the
+            # connection rather than reading the full content.
+            data = res.read(end + 1)[start:]
+            size = res.getheader('Content-Length')
+            self._reset()
+            return data, int(size) if size else None
+        return self.retry(get)
+
+    def map(self, func, items):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            yield from executor.map(func, items)
+
+
+class SiteHandler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serves the pages in raw/site under the paths of the Archive's site, i.e. a local stand-in to
+    test the crawler against:
+
+    >>> server = http.server.ThreadingHTTPServer(
+    ...     ('127.0.0.1', 8000), functools.partial(SiteHandler, directory='raw/site'))
+
+    Pages are stored under different names than they are linked by: The index of languages as
+    index.html, and the index pages of languages as <LID>/index.html.
+    """
+    def translate_path(self, path):
+        d = pathlib.Path(self.directory)
+        path = urllib.parse.unquote(urllib.parse.urlsplit(path).path).lstrip('/')
+        if path == 'Language Indices/index_available.htm':
+            return str(d / 'index.html')
+        if path.startswith('Language/') and path.count('/') == 2:
+            _, lid, fname = path.split('/')
+            if path.lower() in language_index_paths(d):
+                fname = 'index.html'
+            return str(d / lid / fname)
+        return str(d / 'not-found')
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+@functools.lru_cache(maxsize=None)
+def language_index_paths(site_dir):
+    """
+    :return: `set` of the (lowercased) paths of the index pages of languages, as linked from the \
+    index of languages.
+    """
+    return {
+        'language/' + link.attrib['href'].split('/Language/')[1].lower()
+        for link in doc(site_dir / 'index.html').xpath('.//a')
+        if '/Language/' in link.attrib['href']}
+
+
+Languoid = collections.namedtuple(
+    'Languoid', 'id iso name latitude longitude macroarea lineage')
+
+
+class GlottologIndex:
+    """
+    A compact index of Glottolog languoids, mapping Glottocodes and ISO codes to `Languoid`s.
+
+    Scanning the Glottolog repository is slow. Thus, the index is persisted, keyed by the
+    Glottolog version, and only re-built from a full scan for a new version.
+    """
+    def __init__(self, glottolog, cache_dir):
+        self.glottolog = glottolog
+        self.cache_dir = cache_dir
+        self._index = None
+
+    @property
+    def version(self):
+        try:
+            if not self.glottolog.is_dirty():
+                return self.glottolog.describe()
+        except ValueError:  # Not a git repository.
+            pass
+        return None
+
+    def _load(self):
+        version = self.version
+        p = self.cache_dir / 'glottolog-{}.json'.format(version)
+        if version and p.exists():
+            return [Languoid(*row) for row in load(p)]
+
+        languoids = [
+            Languoid(
+                l.id,
+                l.iso,
+                l.name,
+                l.latitude,
+                l.longitude,
+                l.macroareas[0].name if l.macroareas else None,
+                [gc for _, gc, _ in l.lineage])
+            for l in self.glottolog.api.languoids()]
+        if version:
+            for q in self.cache_dir.glob('glottolog-*.json'):
+                q.unlink()
+            dump(languoids, p)
+        return languoids
+
+    def load(self):
+        """
+        Load the index - if it hasn't been loaded yet.
+
+        :return: `self`
+        """
+        if self._index is None:
+            self._index = {}
+            for l in self._load():
+                self._index[l.id] = l
+                if l.iso:
+                    self._index[l.iso] = l
+        return self
+
+    def __getitem__(self, item):
+        return self.load()._index[item]
+
+
+class SQLiteDatabase:
+    """
+    An SQLite database with the data of the CLDF tables, updated in place by `cmd_makecldf`.
+
+    Tables are named after the CLDF components (or the file name of custom tables), columns after
+    the CSV columns. List-valued and JSON columns are stored as JSON, and list-valued columns are
+    additionally available as rows of tables `<table>_<column>`, e.g. `ContributionTable_Media_IDs`.
+    Rows are tagged with the language directory they are derived from, so the data of a language
+    can be replaced without touching the rest of the database.
+    """
+    # Rows in these tables may be derived from several languages:
+    SHARED = {'MediaTable', 'ParameterTable'}
+    FTS = {'FormTable': ['Form'], 'ExampleTable': ['Primary_Text', 'Translated_Text']}
+    INDEXES = {
+        'FormTable': ['Language_ID', 'Parameter_ID'],
+        'ExampleTable': ['Language_ID'],
+        'ContributionTable': ['Language_ID'],
+        'MediaTable': ['Media_Type'],
+    }
+
+    def __init__(self, path, cldf, readonly=False):
+        """
+        Open the database - re-creating it, if it doesn't exist or was created for a different
+        schema, unless opened `readonly`.
+        """
+        self.path = path
+        self.tables = collections.OrderedDict()
+        for table in cldf.tables:
+            component = table.common_props.get('dc:conformsTo')
+            name = component.split('#')[1] if component \
+                else pathlib.Path(table.url.string).stem
+            self.tables[name] = [
+                (col.name,
+                 'INTEGER' if col.datatype and col.datatype.base == 'integer'
+                 else ('REAL' if col.datatype and col.datatype.base in {'decimal', 'float'}
+                       else 'TEXT'),
+                 bool(col.separator))
+                for col in table.tableSchema.columns]
+        schema = hashlib.sha256(json.dumps(
+            [self.tables, self.INDEXES, self.FTS]).encode('utf8')).hexdigest()
+
+        if readonly:
+            if not path.exists():
+                raise ValueError('{} does not exist'.format(path))
+            self.db = sqlite3.connect(path.resolve().as_uri() + '?mode=ro', uri=True)
+        else:
+            self.db = sqlite3.connect(str(path))
+        try:
+            current = self.db.execute("SELECT value FROM _meta WHERE key = 'schema'").fetchone()[0]
+        except sqlite3.OperationalError:
+            current = None
+        if readonly and current != schema:
+            self.db.close()
+            raise ValueError('{} was created for a different schema; re-build it running '
+                             '`cldfbench makecldf`'.format(path))
+        if current != schema:  # A new database, or the table schema changed: Start from scratch.
+            self.db.close()
+            path.unlink(missing_ok=True)
+            self.db = sqlite3.connect(str(path))
+            with self.db:
+                self._create(schema)
+
+    @classmethod
+    def open(cls, path, cldf):
+        """
+        Open an existing database read-only, e.g. for lookups via `recordings` and `media`.
+
+        :raises ValueError: if the database doesn't exist or doesn't match the schema of `cldf`.
+        """
+        return cls(pathlib.Path(path), cldf, readonly=True)
+
+    def _create(self, schema):
+        self.db.execute('CREATE TABLE _meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.execute("INSERT INTO _meta VALUES ('schema', ?)", (schema,))
+        self.db.execute('CREATE TABLE _language (id TEXT PRIMARY KEY, fingerprint TEXT)')
+        for name, cols in self.tables.items():
+            self.db.execute('CREATE TABLE "{}" ({}, _language TEXT)'.format(
+                name,
+                ', '.join('"{}" {}{}'.format(c, t, ' PRIMARY KEY' if c == 'ID' else '')
+                          for c, t, _ in cols)))
+            self.db.execute('CREATE INDEX "{0}__language" ON "{0}"(_language)'.format(name))
+            for col in self.INDEXES.get(name, []):
+                self.db.execute('CREATE INDEX "{0}_{1}" ON "{0}"("{1}")'.format(name, col))
+            for col, _, is_list in cols:
+                if is_list:
+                    self.db.execute(
+                        'CREATE TABLE "{}_{}" (ID TEXT, value TEXT, ord INTEGER, _language TEXT)'
+                        .format(name, col))
+                    for c in ['ID', 'value', '_language']:
+                        self.db.execute('CREATE INDEX "{0}_{1}_{2}" ON "{0}_{1}"({2})'.format(
+                            name, col, c))
+            if name in self.FTS:
+                # An external content full-text index, kept in sync via triggers.
+                fcols = ', '.join('"{}"'.format(c) for c in self.FTS[name])
+                self.db.execute(
+                    'CREATE VIRTUAL TABLE "{0}_fts" USING fts5({1}, content=\'{0}\', '
+                    "content_rowid='rowid')".format(name, fcols))
+                new = ', '.join('new."{}"'.format(c) for c in self.FTS[name])
+                old = ', '.join('old."{}"'.format(c) for c in self.FTS[name])
+                self.db.execute(
+                    'CREATE TRIGGER "{0}_ai" AFTER INSERT ON "{0}" BEGIN INSERT INTO "{0}_fts"'
+                    '(rowid, {1}) VALUES (new.rowid, {2}); END'.format(name, fcols, new))
+                self.db.execute(
+                    'CREATE TRIGGER "{0}_ad" AFTER DELETE ON "{0}" BEGIN INSERT INTO "{0}_fts"'
+                    '("{0}_fts", rowid, {1}) VALUES (\'delete\', old.rowid, {2}); END'.format(
+                        name, fcols, old))
+
+    def fingerprint(self, lid):
+        res = self.db.execute('SELECT fingerprint FROM _language WHERE id = ?', (lid,)).fetchone()
+        return res[0] if res else None
+
+    @staticmethod
+    def _value(v):
+        if isinstance(v, (list, dict)):
+            return json.dumps(v)
+        if isinstance(v, decimal.Decimal):
+            return float(v)
+        return v
+
+    def _insert(self, name, rows, lid, replace=False):
+        cols = self.tables[name]
+        self.db.executemany(
+            'INSERT {}INTO "{}" VALUES ({})'.format(
+                'OR REPLACE ' if replace else '', name, ', '.join('?' * (len(cols) + 1))),
+            [[self._value(row.get(c)) for c, _, _ in cols] + [lid] for row in rows])
+        for col, _, is_list in cols:
+            if is_list:
+                if replace:
+                    self.db.executemany(
+                        'DELETE FROM "{}_{}" WHERE ID = ?'.format(name, col),
+                        [(row['ID'],) for row in rows])
+                self.db.executemany(
+                    'INSERT INTO "{}_{}" VALUES (?, ?, ?, ?)'.format(name, col),
+                    [(row['ID'], v, i, lid)
+                     for row in rows for i, v in enumerate(row.get(col) or [])])
+
+    def _delete(self, lid):
+        for name, cols in self.tables.items():
+            if name not in self.SHARED:
+                self.db.execute('DELETE FROM "{}" WHERE _language = ?'.format(name), (lid,))
+                for col, _, is_list in cols:
+                    if is_list:
+                        self.db.execute(
+                            'DELETE FROM "{}_{}" WHERE _language = ?'.format(name, col), (lid,))
+        self.db.execute('DELETE FROM _language WHERE id = ?', (lid,))
+
+    def update_language(self, lid, fingerprint, rows):
+        """
+        Replace the rows derived from a language directory, unless they are unchanged.
+
+        :param rows: `dict` mapping table names to lists of rows, as returned by \
+        `Dataset.language_rows`.
+        :return: `bool` signaling whether the data was updated.
+        """
+        if self.fingerprint(lid) == fingerprint:
+            return False
+        with self.db:
+            self._delete(lid)
+            for name in self.tables:
+                key = name if name in rows else '{}.csv'.format(name)
+                if key in rows:
+                    self._insert(name, rows[key], lid, replace=name in self.SHARED)
+            self.db.execute('INSERT INTO _language VALUES (?, ?)', (lid, fingerprint))
+        return True
+
+    def finish(self, lids, parameters):
+        """
+        Remove data of languages which no longer exist, replace the parameters and remove media
+        files which are no longer referenced.
+        """
+        with self.db:
+            for lid, in self.db.execute('SELECT id FROM _language').fetchall():
+                if lid not in lids:
+                    self._delete(lid)
+            self.db.execute('DELETE FROM ParameterTable')
+            self._insert('ParameterTable', parameters, None)
+            refs = ' UNION '.join(
+                'SELECT value FROM "{}_{}"'.format(name, col)
+                for name, cols in self.tables.items() for col, _, is_list in cols
+                if is_list and col in {'Media_IDs', 'Scan_IDs'})
+            self.db.execute('DELETE FROM MediaTable WHERE ID NOT IN ({})'.format(refs))
+        self.db.close()
+
+
 def iter_tables(doc):
     def norm(d):
         for k in ['Zulu', 'Hindi', 'Armenian', 'Haiǀǀom', 'Language:']:
@@ -46,36 +583,45 @@ def iter_tables(doc):
     def extract(key, value):
         key = ''.join(key.itertext()).strip()
         if key == 'Rights of Access':
-            value = value.xpath('a')[0].attrib['href']
+            value = value.find('a').attrib['href']
         else:
             value = ''.join(value.itertext()).strip()
         return key, value
 
-    for i, table in enumerate(doc.xpath('.//table'), start=1):
-        md = dict(extract(*tr.xpath('td')) for tr in table.xpath('tr'))
+    # Note: We navigate the element tree using `iter` and `findall` rather than XPath, because
+    # evaluating XPath expressions per row and cell is slow.
+    for i, table in enumerate(doc.iter('table'), start=1):
+        md = dict(extract(*tr.findall('td')) for tr in table.findall('tr'))
         assert int(md['Recording']) == i
         yield i, norm(md)
 
 
 def iter_trs(doc, fname):
     def extract(td, sep='\n'):
-        links = td.xpath('a')
-        if links and 'href' in links[0].attrib:
-            assert len(links) == 1
-            return links[0].attrib['href'], links[0].text
-        if td.xpath('div'):
-            return td.xpath('div')[0].text.strip()
+        if not len(td):  # Most cells contain just text.
+            return (td.text or '').strip()
+        for e in td:
+            if e.tag == 'a':
+                if 'href' in e.attrib:
+                    assert len(td.findall('a')) == 1
+                    return e.attrib['href'], e.text
+                break
+        div = td.find('div')
+        if div is not None:
+            return div.text.strip()
         return sep.join(td.itertext()).strip()
 
-    tables = list(doc.xpath('.//table'))
+    table = None
+    for table in doc.iter('table'):
+        pass
     header = None
-    for i, tr in enumerate(tables[-1].xpath('.//tr')):
+    for i, tr in enumerate(table.iter('tr')):
         if not i:
             header = [
                 ' '.join((extract(e, sep='') or str(i + 1)).split())
-                for i, e in enumerate(tr.xpath('th'))]
+                for i, e in enumerate(tr.findall('th'))]
         else:
-            row = [extract(td) for td in tr.xpath('td')]
+            row = [extract(td) for td in tr.findall('td')]
             if fname in ['hye_word-list_1973_01.html', 'hye_word-list_1983_01.html']:
                 # four columns are stuffed into two
                 assert len(row) == 2
@@ -85,14 +631,93 @@ def iter_trs(doc, fname):
             yield i, dict(zip(header, row))
 
 
+# We parse into plain `lxml.etree` elements, because looking up `lxml.html` element classes for
+# each element accessed is slow.
+HTML_PARSER = lxml.etree.HTMLParser(encoding='utf8')
+
+
 def doc(p):
     # There are corrupted HTML files:
-    return lxml.html.fromstring(p.read_text(encoding='utf8').replace('<t/d>', '</td>'))
+    return lxml.etree.fromstring(p.read_bytes().replace(b'<t/d>', b'</td>'), HTML_PARSER)
+
+
+def parse_language(d):
+    """
+    Parse the pages of the language directory `d`.
+
+    :return: `(key, data)` pair, with key of the form `<language name>|<directory name>`.
+    """
+    # Read the index pages of individual languages:
+    index = doc(d.joinpath('index.html'))
+    lname = index.xpath('.//title')[0].text
+    mds = list(d.glob('*_record_details.html'))
+    assert len(mds) == 1, d
+    md = dict(iter_tables(doc(mds[0])))
+
+    i = -1
+    recordings = []
+    words = {}
+    for i, rec in iter_trs(index, None):
+        rec['details'] = md.get(i, {})
+        if d.name == 'MNR' and i == 1:
+            rec['Word List Entries'] = ('mnr_word-list.html#1', rec['Word List Entries'][1])
+        recordings.append(rec)
+
+        if rec.get('Word List Entries'):
+            fname = rec.get('Word List Entries')[0].split('#')[0]
+            if fname not in words:
+                words[fname] = dict(
+                    scans=[rec[k][0] for
+                           k in ['Scanned Word List (JPG)', 'JPG 2', 'Scanned Word List (TIF)', 'TIF 2']
+                           if rec.get(k)],
+                    words=[w for _, w in iter_trs(doc(d.joinpath(fname)), fname)])
+
+    assert i >= 0
+    return '{}|{}'.format(lname, d.name), dict(recordings=recordings, words=words)
+
+
+def dump_language(d, out):
+    """
+    :return: `(key, seconds)` pair - the time is reported, because profiling the worker processes \
+    directly is not possible.
+    """
+    start = time.perf_counter()
+    key, data = parse_language(d)
+    dump(data, out / '{}.json'.format(d.name), indent=2)
+    return key, time.perf_counter() - start
 
 
 class Dataset(BaseDataset):
     dir = pathlib.Path(__file__).parent
     id = "uclaphoneticslabarchive"
+    # To test the crawler, the site can be served locally, e.g. from raw/site via `SiteHandler`:
+    base_url = env('BASE_URL', BASE_URL)
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.fetcher = Fetcher(workers=env('WORKERS', 8, int))
+        # In refresh mode, existing pages are re-validated using conditional requests:
+        self.refresh = env('REFRESH', False, bool)
+        self.changed = set()
+        self._site_index = None
+        self.profiler = Profiler(env('PROFILE', False, bool), env('CPROFILE', False, bool))
+
+    @property
+    def site_index(self):
+        """
+        Maps paths of pages relative to `site_dir` to the `ETag` and `Last-Modified` headers and
+        the SHA256 digest of their content.
+        """
+        if self._site_index is None:
+            p = self.raw_dir / 'site.json'
+            self._site_index = load(p)['pages'] if p.exists() else {}
+        return self._site_index
+
+    def write_site_index(self):
+        dump(
+            dict(pages=self.site_index, changed=sorted(self.changed)),
+            self.raw_dir / 'site.json',
+            indent=2)
 
     @property
     def site_dir(self):
@@ -101,8 +726,29 @@ class Dataset(BaseDataset):
             res.mkdir()
         return res
 
-    def get_page(self, path=None, fname=None):
-        url = '{}Language%20Indices/index_available.htm'.format(BASE_URL)
+    @property
+    def recordings_dir(self):
+        res = self.raw_dir / 'recordings'
+        if not res.exists():
+            res.mkdir()
+        return res
+
+    @property
+    def clips_dir(self):
+        res = self.raw_dir / 'clips'
+        if not res.exists():
+            res.mkdir()
+        return res
+
+    @property
+    def cache_dir(self):
+        res = self.raw_dir / 'cache'
+        if not res.exists():
+            res.mkdir()
+        return res
+
+    def page_location(self, path=None, fname=None):
+        url = '{}Language%20Indices/index_available.htm'.format(self.base_url)
         target = self.site_dir / 'index.html'
 
         if path:
@@ -111,22 +757,73 @@ class Dataset(BaseDataset):
             lid, fname_ = path.split('Language/')[1].split('/', maxsplit=1)
             fname = fname or fname_
             url = urllib.parse.urljoin(url, path)
-            if not self.raw_dir.joinpath('site', lid).exists():
-                self.raw_dir.joinpath('site', lid).mkdir()
+            self.site_dir.joinpath(lid).mkdir(exist_ok=True)
             target = self.site_dir / lid / fname
 
         # Wrong wordlist linked from MNR index:
         url = url.replace('/MNR/bul_word-list_1971_01', '/MNR/mnr_word-list')
         # Non-existing page linked instead of wordist:
         url = url.replace('amh_conversation_1967', 'amh_word-list_1967')
+        return url, target
 
-        if not target.exists():
-            print(url)
-            urllib.request.urlretrieve(url, target)
+    def _fetch(self, url, target):
+        exists = target.exists()
+        if exists and not self.refresh:
+            return url, target
+
+        key = target.relative_to(self.site_dir).as_posix()
+        info, headers = self.site_index.get(key, {}), {}
+        if exists and info.get('etag'):
+            headers['If-None-Match'] = info['etag']
+        if exists and info.get('last_modified'):
+            headers['If-Modified-Since'] = info['last_modified']
+
+        print(url)
+        new = target.parent / '{}.new'.format(target.name)
+        with self.profiler.stage('fetch', key.split('/')[0] if '/' in key else None):
+            res = self.fetcher.fetch(url, new, headers=headers)
+        if res.status != 304:
+            digest = hashlib.sha256(new.read_bytes()).hexdigest()
+            if exists and digest == hashlib.sha256(target.read_bytes()).hexdigest():
+                new.unlink()
+            else:
+                os.replace(new, target)
+                if '/' in key:
+                    self.changed.add(key.split('/')[0])
+            self.site_index[key] = dict(
+                url=url,
+                etag=res.getheader('ETag'),
+                last_modified=res.getheader('Last-Modified'),
+                sha256=digest)
         return url, target
 
+    def get_page(self, path=None, fname=None):
+        return self._fetch(*self.page_location(path, fname))
+
+    def get_pages(self, specs):
+        """
+        Retrieve pages concurrently.
+
+        :param specs: Iterable of `(path, fname)` pairs as accepted by `get_page`.
+        """
+        # Several links may point to the same page, but each page must be fetched only once.
+        locations = {}
+        for path, fname in specs:
+            url, target = self.page_location(path, fname)
+            locations.setdefault(target, url)
+        return list(self.fetcher.map(
+            lambda item: self._fetch(*item), [(url, t) for t, url in locations.items()]))
+
     def cldf_specs(self):
-        return CLDFSpec(dir=self.cldf_dir, module="Wordlist")
+        return CLDFSpec(dir=self.cldf_dir, module="Wordlist", writer_cls=Writer)
+
+    def _cmd_download(self, args):
+        with self.profiler.run('download', self.dir / 'profile-download', args.log):
+            super()._cmd_download(args)
+
+    def _cmd_makecldf(self, args):
+        with self.profiler.run('makecldf', self.dir / 'profile-makecldf', args.log):
+            super()._cmd_makecldf(args)
 
     def cmd_readme(self, args: argparse.Namespace) -> str:
         # link map and ERD
@@ -156,18 +853,77 @@ detailed descriptions of the individual columns, see [the CLDF README](cldf/READ
             section='Description')
 
     def cmd_download(self, args):
-        # Read the language index:
-        for link in doc(self.get_page()[1]).xpath('.//a'):
-            if '/Language/' in link.attrib['href']:
-                self.get_page('../Language' + link.attrib['href'].split('/Language')[1], fname='index.html')
-
-        data = {}
+        # The parsed data is only valid if the download runs to completion:
+        index = self.recordings_dir / 'index.json'
+        parsed = load(index) if index.exists() else {}
+        if not isinstance(parsed, dict):  # The list of keys written by earlier versions.
+            parsed = {}
+        index.unlink(missing_ok=True)
+
+        with self.profiler.stage('index pages'):
+            self.get_index_pages()
+
+        with self.profiler.stage('pages'):
+            self.get_language_pages()
+        self.write_site_index()
+        if self.changed:
+            args.log.info('Changed language directories: {}'.format(' '.join(sorted(self.changed))))
+
+        with self.profiler.stage('parse'):
+            n = self.parse_language_dirs(parsed)
+        args.log.info('Parsed {} language directories'.format(n))
+
+    def parse_language_dirs(self, parsed):
+        """
+        Parse the pages of language directories in parallel, each process writing the data for one
+        directory to a separate file in raw/recordings/.
+
+        Only directories with changed pages are parsed again - unless the parsing code changed.
+
+        :param parsed: The content of raw/recordings/index.json as written by the previous run.
+        :return: Number of parsed directories.
+        """
+        code = code_digest(doc, iter_tables, iter_trs, parse_language, dump_language)
+        keys = {key.split('|')[1]: key for key in parsed.get('keys', [])} \
+            if parsed.get('code') == code else {}
+        dirs = sorted(d for d in self.site_dir.iterdir() if d.is_dir())
+        todo = [
+            d for d in dirs if d.name in self.changed or d.name not in keys
+            or not self.recordings_dir.joinpath('{}.json'.format(d.name)).exists()]
+        keep = {d.name for d in dirs} - {d.name for d in todo}
+        for p in self.recordings_dir.glob('*.json'):
+            if p.stem not in keep:
+                p.unlink()
+        keys = {dname: key for dname, key in keys.items() if dname in keep}
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=env('PROCESSES', None, int)) as ex:
+            for d, (key, seconds) in zip(
+                    todo, ex.map(functools.partial(dump_language, out=self.recordings_dir), todo)):
+                keys[d.name] = key
+                self.profiler.record('parse language', seconds, language=d.name)
+        dump(
+            dict(code=code, keys=sorted(keys.values())),
+            self.recordings_dir / 'index.json',
+            indent=2)
+        return len(todo)
+
+    def get_index_pages(self):
+        """
+        Retrieve the index of languages and the index pages of the individual languages.
+        """
+        self.get_pages(
+            ('../Language' + link.attrib['href'].split('/Language')[1], 'index.html')
+            for link in doc(self.get_page()[1]).xpath('.//a')
+            if '/Language/' in link.attrib['href'])
+
+    def get_language_pages(self):
+        """
+        Retrieve the pages linked from the index pages of the individual languages.
+        """
+        pages = []
         for d in self.site_dir.iterdir():
             if d.is_dir():
-                # Read the index pages of individual languages:
-                index = doc(d.joinpath('index.html'))
-                for link in index.xpath('.//a'):
-                    # Retrieve linked pages:
+                for link in doc(d.joinpath('index.html')).xpath('.//a'):
                     href = link.attrib['href']
                     if not (href.startswith('..') or href.startswith('http:')):
                         if any(suffix in href for suffix in ['.wav', '.tif', '.mp3', '.jpg']):
@@ -176,185 +932,303 @@ detailed descriptions of the individual columns, see [the CLDF README](cldf/READ
                         if not href and d.name == 'MZQ':
                             # MZQ has record details, but the link is not correct!
                             href = 'mzq_record_details.html'
-                        self.get_page('../Language/{}/{}'.format(d.name, href.split('#')[0]))
-
-                lname = index.xpath('.//title')[0].text
-                mds = list(d.glob('*_record_details.html'))
-                assert len(mds) == 1, d
-                md = dict(iter_tables(lxml.html.fromstring(mds[0].read_text(encoding='utf8'))))
-
-                i = -1
-                recordings = []
-                words = {}
-                for i, rec in iter_trs(index, None):
-                    rec['details'] = md.get(i, {})
-                    if d.name == 'MNR' and i == 1:
-                        rec['Word List Entries'] = ('mnr_word-list.html#1', rec['Word List Entries'][1])
-                    recordings.append(rec)
-
-                    if rec.get('Word List Entries'):
-                        fname = rec.get('Word List Entries')[0].split('#')[0]
-                        if fname not in words:
-                            words[fname] = dict(
-                                scans=[rec[k][0] for
-                                       k in ['Scanned Word List (JPG)', 'JPG 2', 'Scanned Word List (TIF)', 'TIF 2']
-                                       if rec.get(k)],
-                                words=[w for _, w in iter_trs(doc(d.joinpath(fname)), fname)])
-
-                assert i >= 0
-                data['{}|{}'.format(lname, d.name)] = dict(recordings=recordings, words=words)
-
-        dump(data, self.raw_dir / 'recordings.json', indent=2)
+                        pages.append(('../Language/{}/{}'.format(d.name, href.split('#')[0]), None))
+        self.get_pages(pages)
+
+    def iter_recordings(self):
+        """
+        Read the data parsed from the language directories - one directory at a time.
+
+        :return: Generator of `(key, data)` pairs, sorted by key.
+        """
+        for key in load(self.recordings_dir / 'index.json')['keys']:
+            yield key, load(self.recordings_dir / '{}.json'.format(key.split('|')[1]))
 
     def cmd_makecldf(self, args):
-        self.schema(args.writer.cldf)
+        # Word clips detected in the audio of word list recordings by `cldfbench ucla.segment`:
+        clips = {p.stem: load(p) for p in self.clips_dir.glob('*.json')}
+        self.schema(args.writer.cldf, with_clips=bool(clips))
 
         wordlist_fields = load(self.etc_dir / 'wordlist_fields.json')
         fnames = {tuple(k.split('/')): v for k, v in load(self.etc_dir / 'urls.json').items()}
-        mids = {}
-
-        fields = collections.Counter()
-        glangs = {}
-        for l in args.glottolog.api.languoids():
-            glangs[l.id] = l
-            if l.iso:
-                glangs[l.iso] = l
-
+        dir_fnames = collections.defaultdict(dict)
+        for (dname, fname), v in fnames.items():
+            dir_fnames[dname][fname] = v
+
+        with self.profiler.stage('glottolog'):
+            # The index is loaded eagerly, to attribute the time to this stage.
+            glangs = GlottologIndex(args.glottolog, self.cache_dir).load()
+        rules = load(self.etc_dir / 'normalization.json')
+        normalizer = Normalizer(rules)
+
+        # In incremental mode, the rows derived from a language are cached and only re-computed
+        # if the input data for the language - or the code computing the rows - changed.
+        incremental = env('INCREMENTAL', False, bool)
+        code = code_digest(Dataset.language_rows, Normalizer, iter_words, EntryIndex, linked_words)
+
+        # The SQLite database is updated in place, i.e. only for languages with changed data.
+        db = env('SQLITE', str(self.cache_dir / 'ucla.sqlite'))
+        db = SQLiteDatabase(pathlib.Path(db), args.writer.cldf) if db else None
+
+        mids, updated = set(), 0
+        normalization = collections.Counter()
         concepts = collections.defaultdict(set)
-        for k, data in load(self.raw_dir / 'recordings.json').items():
+        for k, data in self.iter_recordings():
             lname, dname = k.split('|')
-            glang = glangs[GLOTTOCODES[dname]] if dname in GLOTTOCODES else glangs[dname.lower()]
-
-            geolang = glang
-            if geolang.latitude is None:
-                geolang = glangs[glang.lineage[-1][1]]
-                assert geolang.latitude is not None
-
-            args.writer.objects['LanguageTable'].append(dict(
-                ID=dname,
-                Name=lname,
-                Glottocode=glang.id,
-                Latitude=geolang.latitude,
-                Longitude=geolang.longitude,
-                Macroarea=glang.macroareas[0].name,
-                ISO639P3code=glang.iso,
-                Family_Name=glangs[glang.lineage[0][1]].name if glang.lineage else 'Isolate',
-            ))
-
-            wordlist2ids = collections.defaultdict(list)
-            text2ids = collections.defaultdict(list)
-            for fname, words in data['words'].items():
-                for form, gloss, entry, eid in iter_words(
-                        fname, words['words'], wordlist_fields[dname][fname]):
-                    if not any(cue in fname for cue in ['word-list', 'ear-training', 'sounds']):
-                        text2ids[fname].append((eid, int(entry['Entry'])))
-                        args.writer.objects['ExampleTable'].append(dict(
-                            ID=eid,
-                            Language_ID=dname,
-                            Primary_Text=form,
-                            Translated_Text=gloss,
-                            Speaker=entry.get('Speaker'),
-                            original_data=entry,
-                        ))
-                    else:
-                        pid = slug(gloss) or 'NA'
-                        concepts[pid].add(gloss)
-                        wordlist2ids[fname].append((eid, int(entry['Entry'])))
-                        args.writer.objects['FormTable'].append(dict(
-                            ID=eid,
-                            Form=norm_form(form),
-                            Language_ID=dname,
-                            Parameter_ID=pid,
-                            original_data=entry,
-                            Scan_IDs=[fname.replace('.', '_') for fname in words['scans']],
-                        ))
-
-            for rid, r in enumerate(data['recordings'], start=1):
-                fields.update([k for k, v in r.items() if v])
-
-                wids, tids = [], []
-                wordlist_entries = r['Word List Entries']
-                if wordlist_entries:
-                    fname, items = wordlist_entries
-                    fname = fname.split('#')[0]
-                    if fname in wordlist2ids:
-                        wids = linked_words(fname, items, wordlist2ids[fname])
-                    else:
-                        tids = linked_words(fname, items, text2ids[fname])
-
-                ncontents = norm_contents(r['details'].get('Recording Contents', ''))
-                date, year = norm_date(r['details'].get('Recording Date'))
-                args.writer.objects['ContributionTable'].append(dict(
-                    ID='{}-{}'.format(dname, rid),
-                    Name='{} recording {}'.format(lname, rid),
-                    Description='Recording of {}'.format(' and '.join(ncontents)),
-                    Position=rid,
-                    Language_ID=dname,
-                    Contributor=norm_fieldworker(r['details'].get('Fieldworkers')),
-                    contents=ncontents,
-                    location=norm_location(r['details'].get('Recording Location')),
-                    date=date,
-                    year=year,
-                    rights_of_access=r['details'].get('Rights of Access'),
-                    Media_IDs=[],
-                    Form_IDs=wids,
-                    Text_IDs=tids,
-                    dialect=norm_dialect(r['details'].get('Dialect')),
-                    speakers=norm_speakers(r['details'].get('Speakers')),
-                    speaker_name=norm_speaker_name(r['details'].get('Speaker Name')),
-                    speaker_origin=norm_speaker_origin(r['details'].get('Speaker Origin')),
-                    wordlist_entries=r['details'].get('Unicode Word List Entries'),
-                    original_recording_medium=norm_orm(r['details'].get('Original Recording Medium')),
-                ))
-                rec = args.writer.objects['ContributionTable'][-1]
-                for suffix in [
-                    'WAV',
-                    'MP3',
-                    ('Scanned Word List (JPG)', 'JPG'),
-                    ('Scanned Word List (TIF)', 'TIF'),
-                    ('JPG 2', 'JPG'),
-                    ('TIF 2', 'TIF'),
-                ]:
-                    if isinstance(suffix, tuple):
-                        attr, suffix = suffix
-                    else:
-                        attr = suffix
-                    quality = {
-                        'WAV': ['WAV Digitization Quality'],
-                        'MP3': ['MP3 Bit Rate'],
-                        'JPG': ['JPG Quality', 'JPG Image Quality'],
-                        'TIF': ['TIFF Image Quality'],
-                    }
-                    desc = None
-                    for prop in quality[suffix]:
-                        if prop in r['details']:
-                            desc = r['details'][prop]
-                            break
-                    fname = r[attr][0] if isinstance(r.get(attr), list) else r.get(attr)
-                    if fname and fnames[dname, fname][0]:
-                        # There are a handful of linked files which do not exist on the server.
-                        rec['Media_IDs'].append(fname.replace('.', '_'))
-                        if fname not in mids:
-                            args.writer.objects['MediaTable'].append(dict(
-                                ID=fname.replace('.', '_'),
-                                Name=fname,
-                                Description=desc,
-                                Media_Type=mimetypes.guess_type('a.' + suffix)[0],
-                                Download_URL=fnames[dname, fname][0],
-                                size=fnames[dname, fname][1],
-                                length=fnames[dname, fname][2],
-                            ))
-                            mids[fname] = fname.replace('.', '_')
-                    elif fname:
-                        args.log.warning('No URL for linked file {}'.format(fname))
+            language = self.language(glangs, lname, dname)
+            fingerprint = hashlib.sha256(json.dumps([
+                code,
+                language,
+                data,
+                wordlist_fields.get(dname),
+                dir_fnames[dname],
+                rules,
+                clips.get(dname),
+            ], sort_keys=True).encode('utf8')).hexdigest()
+            cached = self.cache_dir / 'makecldf' / '{}.json'.format(dname)
+            rows = load(cached) if incremental and cached.exists() else None
+            if not (rows and rows['fingerprint'] == fingerprint):
+                with self.profiler.stage('language_rows', dname):
+                    rows = self.language_rows(
+                        language,
+                        data,
+                        wordlist_fields.get(dname),
+                        fnames,
+                        normalizer,
+                        clips.get(dname),
+                        self.profiler)
+                rows['fingerprint'] = fingerprint
+                if incremental:
+                    cached.parent.mkdir(parents=True, exist_ok=True)
+                    dump(rows, cached)
+
+            for t in ['LanguageTable', 'ExampleTable', 'FormTable', 'ContributionTable']:
+                args.writer.objects[t].extend(rows[t])
+            if clips:
+                args.writer.objects['clips.csv'].extend(rows['clips.csv'])
+            for row in rows['MediaTable']:
+                # The same file may be linked from recordings of different languages.
+                if row['ID'] not in mids:
+                    args.writer.objects['MediaTable'].append(row)
+                    mids.add(row['ID'])
+            for pid, gloss in rows['concepts']:
+                concepts[pid].add(gloss)
+            for msg in rows['warnings']:
+                args.log.warning(msg)
+            normalization.update(rows['normalization'])
+            if db:
+                with self.profiler.stage('sqlite', dname):
+                    updated += db.update_language(dname, fingerprint, rows)
 
         for pid, glosses in sorted(concepts.items()):
             args.writer.objects['ParameterTable'].append(dict(
                 ID=pid,
                 Name=' | '.join(sorted(glosses))
             ))
+        self.report_normalization(args.log, rules, normalization)
+        if db:
+            with self.profiler.stage('sqlite'):
+                db.finish(
+                    {row['ID'] for row in args.writer.objects['LanguageTable']},
+                    args.writer.objects['ParameterTable'])
+            args.log.info('Updated data of {} languages in {}'.format(updated, db.path))
+
+    @staticmethod
+    def report_normalization(log, rules, counts):
+        """
+        Log how often the rules in etc/normalization.json fired - and which didn't fire at all and
+        may thus be removed.
+        """
+        for field, spec in rules.items():
+            keys = ['{}: {}'.format(field, v) for v in spec.get('missing', [])]
+            keys.extend('{}: *{}'.format(field, v) for v in spec.get('missing_suffixes', []))
+            keys.extend('{}: {}'.format(field, v) for v in spec.get('map', {}))
+            keys.extend('{}: *{}*'.format(field, v) for v in spec.get('replace', {}))
+            log.info('Normalized {} values of "{}" ({})'.format(
+                sum(counts[k] for k in keys),
+                field,
+                ', '.join('{}: {}'.format(k.split(': ', 1)[1], counts[k])
+                          for k in sorted(keys, key=lambda k: -counts[k]))))
+            unused = [k for k in keys if not counts[k]]
+            if unused:
+                log.info('Rules which never fired: {}'.format('; '.join(unused)))
+
+    @staticmethod
+    def language(glangs, lname, dname):
+        glang = glangs[GLOTTOCODES[dname]] if dname in GLOTTOCODES else glangs[dname.lower()]
+
+        geolang = glang
+        if geolang.latitude is None:
+            geolang = glangs[glang.lineage[-1]]
+            assert geolang.latitude is not None
+
+        return dict(
+            ID=dname,
+            Name=lname,
+            Glottocode=glang.id,
+            Latitude=geolang.latitude,
+            Longitude=geolang.longitude,
+            Macroarea=glang.macroarea,
+            ISO639P3code=glang.iso,
+            Family_Name=glangs[glang.lineage[0]].name if glang.lineage else 'Isolate',
+        )
 
-    def schema(self, cldf):
+    @staticmethod
+    def language_rows(
+            language, data, wordlist_fields, fnames, normalizer, clips=None, profiler=None):
+        """
+        Compute the rows for all CLDF tables derived from the data of one language directory.
+
+        :param normalizer: `Normalizer` instance.
+        :param clips: `dict` mapping recording IDs to word clips detected by `ucla.segment`.
+        :param profiler: `Profiler` instance.
+        """
+        profiler = profiler or Profiler()
+        dname, lname = language['ID'], language['Name']
+        res = dict(
+            LanguageTable=[language],
+            ExampleTable=[],
+            FormTable=[],
+            ContributionTable=[],
+            MediaTable=[],
+            concepts=[],
+            warnings=[],
+            normalization=collections.Counter(),
+        )
+        res['clips.csv'] = []
+        mids = set()
+        concepts = set()
+
+        wordlist2ids = collections.defaultdict(list)
+        text2ids = collections.defaultdict(list)
+        for fname, words in data['words'].items():
+            with profiler.stage('iter_words', dname):
+                entries = list(iter_words(fname, words['words'], wordlist_fields[fname]))
+            for form, gloss, entry, eid in entries:
+                if not any(cue in fname for cue in ['word-list', 'ear-training', 'sounds']):
+                    text2ids[fname].append((eid, int(entry['Entry'])))
+                    res['ExampleTable'].append(dict(
+                        ID=eid,
+                        Language_ID=dname,
+                        Primary_Text=form,
+                        Translated_Text=gloss,
+                        Speaker=entry.get('Speaker'),
+                        original_data=entry,
+                    ))
+                else:
+                    pid = slug(gloss) or 'NA'
+                    if (pid, gloss) not in concepts:
+                        res['concepts'].append((pid, gloss))
+                        concepts.add((pid, gloss))
+                    wordlist2ids[fname].append((eid, int(entry['Entry'])))
+                    res['FormTable'].append(dict(
+                        ID=eid,
+                        Form=normalizer.form(form, res['normalization']),
+                        Language_ID=dname,
+                        Parameter_ID=pid,
+                        original_data=entry,
+                        Scan_IDs=[fname.replace('.', '_') for fname in words['scans']],
+                    ))
+
+        # Word lists and texts are indexed by entry number once, for all recordings linking to them:
+        indexes = {fname: EntryIndex(fname, items) for fname, items in wordlist2ids.items()}
+        indexes.update((fname, EntryIndex(fname, items)) for fname, items in text2ids.items())
+        details = [
+            normalizer.details(r['details'], res['normalization']) for r in data['recordings']]
+        for rid, (r, ndetails) in enumerate(zip(data['recordings'], details), start=1):
+            wids, tids = [], []
+            wordlist_entries = r['Word List Entries']
+            if wordlist_entries:
+                fname, items = wordlist_entries
+                fname = fname.split('#')[0]
+                with profiler.stage('linked_words', dname):
+                    if fname in wordlist2ids:
+                        wids = linked_words(items, indexes[fname])
+                    else:
+                        tids = linked_words(items, indexes[fname])
+
+            rec = dict(
+                ID='{}-{}'.format(dname, rid),
+                Name='{} recording {}'.format(lname, rid),
+                Description='Recording of {}'.format(' and '.join(ndetails['contents'])),
+                Position=rid,
+                Language_ID=dname,
+                Contributor=ndetails['Contributor'],
+                contents=ndetails['contents'],
+                location=ndetails['location'],
+                date=ndetails['date'],
+                year=ndetails['year'],
+                rights_of_access=r['details'].get('Rights of Access'),
+                Media_IDs=[],
+                Form_IDs=wids,
+                Text_IDs=tids,
+                dialect=ndetails['dialect'],
+                speakers=ndetails['speakers'],
+                speaker_name=ndetails['speaker_name'],
+                speaker_origin=ndetails['speaker_origin'],
+                wordlist_entries=r['details'].get('Unicode Word List Entries'),
+                original_recording_medium=ndetails['original_recording_medium'],
+            )
+            res['ContributionTable'].append(rec)
+            for suffix in [
+                'WAV',
+                'MP3',
+                ('Scanned Word List (JPG)', 'JPG'),
+                ('Scanned Word List (TIF)', 'TIF'),
+                ('JPG 2', 'JPG'),
+                ('TIF 2', 'TIF'),
+            ]:
+                if isinstance(suffix, tuple):
+                    attr, suffix = suffix
+                else:
+                    attr = suffix
+                quality = {
+                    'WAV': ['WAV Digitization Quality'],
+                    'MP3': ['MP3 Bit Rate'],
+                    'JPG': ['JPG Quality', 'JPG Image Quality'],
+                    'TIF': ['TIFF Image Quality'],
+                }
+                desc = None
+                for prop in quality[suffix]:
+                    if prop in r['details']:
+                        desc = r['details'][prop]
+                        break
+                fname = r[attr][0] if isinstance(r.get(attr), list) else r.get(attr)
+                if fname and fnames[dname, fname][0]:
+                    # There are a handful of linked files which do not exist on the server.
+                    rec['Media_IDs'].append(fname.replace('.', '_'))
+                    if fname not in mids:
+                        res['MediaTable'].append(dict(
+                            ID=fname.replace('.', '_'),
+                            Name=fname,
+                            Description=desc,
+                            Media_Type=mimetypes.guess_type('a.' + suffix)[0],
+                            Download_URL=fnames[dname, fname][0],
+                            size=fnames[dname, fname][1],
+                            length=fnames[dname, fname][2],
+                        ))
+                        mids.add(fname)
+                elif fname:
+                    res['warnings'].append('No URL for linked file {}'.format(fname))
+
+            clip = (clips or {}).get(rec['ID'])
+            if clip:
+                if clip['media'].replace('.', '_') not in rec['Media_IDs'] \
+                        or [fid for fid, _, _ in clip['forms']] != rec['Form_IDs']:
+                    res['warnings'].append('Outdated clips for recording {}'.format(rec['ID']))
+                    continue
+                for fid, start, end in clip['forms']:
+                    res['clips.csv'].append(dict(
+                        ID='{}-{}'.format(rec['ID'], fid),
+                        Form_ID=fid,
+                        Contribution_ID=rec['ID'],
+                        Media_ID=clip['media'].replace('.', '_'),
+                        Start=start,
+                        End=end,
+                    ))
+        return res
+
+    def schema(self, cldf, with_clips=False):
         cldf.properties['dc:description'] = \
             ("This CLDF dataset provides the data of the UCLA Phonetics Lab Archive. It is modeled "
              "as a CLDF `Wordlist` because most of the recordings contain elicitations of "
@@ -498,130 +1372,128 @@ detailed descriptions of the individual columns, see [the CLDF README](cldf/READ
              "given as `Primary_Text` or `Translated_Text` rather than omitting the phrase, "
              "because we want to record all metadata as well as the fact that some phrase appears "
              "in a certain position in the recordings or scans.")
-
-
-def norm_form(c):
-    if c in [
-        "(no transcription)",
-        "----",
-        "No transcription given",
-        "no phonemic transcription given",
-        "Transcription illegible",
-        "No IPA given",
-        "(not on wordlist)",
-    ]:
-        return 'NA'
-    return c
-
-
-def norm_dialect(c):
-    if c in """dialect not specified
-Dialect not specified
-dialects not specified
-dialect unknown
-dialect unkown
-dialect unspecified
-Dialect unspecified
-N/A
-not specified
-Speaker dialect not specified
-unknown""".split('\n'):
-        return None
-    return c
-
-
-def norm_speakers(c):
-    if not c:
-        return None
-    if c in 'unknown n/a N/A':
-        return None
-    return c
-
-
-def norm_speaker_name(c):
-    if not c:
-        return None
-    if c in 'Speaker not identified Speaker name unspecified N/A unknown Unknown':
-        return None
-    return c
-
-
-def norm_speaker_origin(c):
-    if not c:
-        return None
-    if c in """Speaker origin not specified
-Speakers' origins not specified
-Speaker origin not specified
-Speaker origins not specified
-Speaker origins unknown
-speaker origin unknown
-Speaker origin unknown
-Speaker Origin Unknown
-Speaker origin unspecified
-not specified
-unknown""".split('\n'):
-        return None
-    return c
-
-
-def norm_fieldworker(c):
-    if c in [
-        'Fieldworker not specified',
-        'fieldworker(s) not specified',
-        'Fieldworker(s) unspecified',
-        'N/A',
-        'not specified',
-        'unknown',
-        'Unknown',
-        'Unspecified',
-    ]:
-        return None
-    return c
-
-
-def norm_orm(c):
-    return {
-        '32K DAT': ["DAT tape, 32 kHz"],
-        "48K DAT": ["DAT tape, 48 kHz"],
-        "casette tape": ["cassette tape"],
-        "Casette tape": ["cassette tape"],
-        "Casette Tape": ["cassette tape"],
-        "cassette": ["cassette tape"],
-        "Cassette tape": ["cassette tape"],
-        "Cassette Tape": ["cassette tape"],
-        "reel tape": [""],
-        "Reel tape": ["reel tape"],
-        "Reel Tape": ["reel tape"],
-        "Reel Tape, Cassette Tape": ["reel tape", "cassette tape"],
-        "unknown": None,
-        "Unknown": None,
-    }.get(c, [c])
-
-
-def norm_date(c):
-    if not c:
-        return None, None
-    if c in [
-        'N/A',
-        'not specified',
-        'Recording date(s) not given',
-        'Date unspecified',
-    ]:
-        return None, None
-    if c.lower().endswith('unknown'):
-        return None, None
-    m = re.search('(?P<year>[0-9]{4})', c)
-    assert m
-    return c, int(m.group('year')) or None
-
-
-def norm_location(c):
-    return None if c and c.lower() == 'unknown' else c
-
-
-def norm_contents(c):
-    c = re.split(' and |, ', c.lower().replace('Running speech', 'continuous speech'))
-    return sorted([w.replace('wordlist', 'word list') for w in c])
+        if with_clips:
+            t = cldf.add_table(
+                'clips.csv',
+                {
+                    'name': 'ID',
+                    'propertyUrl': 'http://cldf.clld.org/v1.0/terms.rdf#id',
+                },
+                {
+                    'name': 'Form_ID',
+                    'propertyUrl': 'http://cldf.clld.org/v1.0/terms.rdf#formReference',
+                },
+                {
+                    'name': 'Contribution_ID',
+                    'propertyUrl': 'http://cldf.clld.org/v1.0/terms.rdf#contributionReference',
+                },
+                {
+                    'name': 'Media_ID',
+                    'propertyUrl': 'http://cldf.clld.org/v1.0/terms.rdf#mediaReference',
+                },
+                {
+                    'name': 'Start',
+                    'datatype': 'float',
+                    'dc:description': 'Start of the word in the audio file in seconds',
+                },
+                {
+                    'name': 'End',
+                    'datatype': 'float',
+                    'dc:description': 'End of the word in the audio file in seconds',
+                },
+            )
+            t.common_props['dc:description'] = \
+                ("Offsets of the words of a word list recording in the WAV file of the recording. "
+                 "The word boundaries have been detected automatically, from the energy of the "
+                 "audio signal, and may thus be imprecise.")
+
+
+class Normalizer:
+    """
+    Normalizes the word forms and the details of recordings given on the site, according to the
+    rules in etc/normalization.json - mapping the various ways of saying "unknown" to `None` and
+    spelling variants to one canonical value.
+
+    Each method takes a `collections.Counter` to which the rules that fired are added, keyed as
+    `<field>: <value>` (`<field>: *<suffix>` for suffixes, `<field>: *<substring>*` for
+    replacements).
+    """
+    def __init__(self, rules):
+        self.ignore_case = {k for k, v in rules.items() if v.get('ignore_case')}
+        self.missing = {
+            k: frozenset(s.lower() if k in self.ignore_case else s for s in v.get('missing', []))
+            for k, v in rules.items()}
+        self.missing_suffixes = {
+            k: tuple(s.lower() for s in v.get('missing_suffixes', [])) for k, v in rules.items()}
+        self.map = {k: v.get('map', {}) for k, v in rules.items()}
+        self.replace = {k: v.get('replace', {}) for k, v in rules.items()}
+
+    def _missing(self, field, c, counts):
+        key = c.lower() if c and field in self.ignore_case else c
+        if key in self.missing[field]:
+            counts['{}: {}'.format(field, key)] += 1
+            return True
+        for suffix in self.missing_suffixes[field]:
+            if c and c.lower().endswith(suffix):
+                counts['{}: *{}'.format(field, suffix)] += 1
+                return True
+        return False
+
+    def _value(self, field, c, counts):
+        return None if self._missing(field, c, counts) else c
+
+    def form(self, c, counts):
+        return 'NA' if self._missing('Form', c, counts) else c
+
+    def contents(self, c, counts):
+        res = []
+        for w in re.split(' and |, ', c.lower()):
+            if w in self.map['Recording Contents']:
+                counts['Recording Contents: {}'.format(w)] += 1
+                w = self.map['Recording Contents'][w]
+            for old, new in self.replace['Recording Contents'].items():
+                if old in w:
+                    counts['Recording Contents: *{}*'.format(old)] += 1
+                    w = w.replace(old, new)
+            res.append(w)
+        return sorted(res)
+
+    def date(self, c, counts):
+        if not c or self._missing('Recording Date', c, counts):
+            return None, None
+        m = re.search('(?P<year>[0-9]{4})', c)
+        assert m
+        return c, int(m.group('year')) or None
+
+    def orm(self, c, counts):
+        if self._missing('Original Recording Medium', c, counts):
+            return None
+        if c in self.map['Original Recording Medium']:
+            counts['Original Recording Medium: {}'.format(c)] += 1
+            return self.map['Original Recording Medium'][c]
+        return [c]
+
+    def details(self, details, counts):
+        """
+        Normalize the details of a recording.
+
+        :return: `dict` of `ContributionTable` columns.
+        """
+        contents = self.contents(details.get('Recording Contents', ''), counts)
+        date, year = self.date(details.get('Recording Date'), counts)
+        return dict(
+            Contributor=self._value('Fieldworkers', details.get('Fieldworkers'), counts),
+            contents=contents,
+            location=self._value('Recording Location', details.get('Recording Location'), counts),
+            date=date,
+            year=year,
+            dialect=self._value('Dialect', details.get('Dialect'), counts),
+            speakers=self._value('Speakers', details.get('Speakers'), counts) or None,
+            speaker_name=self._value('Speaker Name', details.get('Speaker Name'), counts) or None,
+            speaker_origin=self._value(
+                'Speaker Origin', details.get('Speaker Origin'), counts) or None,
+            original_recording_medium=self.orm(details.get('Original Recording Medium'), counts),
+        )
 
 
 def iter_words(fname, words, fieldmap):
@@ -666,49 +1538,73 @@ def iter_words(fname, words, fieldmap):
         leid = w['Entry']
 
 
-def linked_words(fname, ranges, items):
-    batches = []
-    batch = []
-    leid = -1
-    for id_, eid in items:
-        if eid == 1 and batch and leid > 1:
-            # There are more sets of entry numbers starting with 1.
-            batches.append(batch)
-            batch = []
-        batch.append((id_, eid))
-        leid = eid
-    assert batch, '{}: {}\t{}'.format(fname, ranges, len(items))
-    batches.append(batch)
-
-    entry_numbers = []
-    for r in ranges.split(','):  # multiple ranges
-        if r.lower() == 'paragraph':
-            entry_numbers.append([1])
-        else:
-            if '-' in r:
-                s, e = [int(d.strip()) for d in r.split('-')]
-                entry_numbers.append(list(range(s, e + 1)))
-            else:
-                entry_numbers.append([int(r.strip())])
-
-    wids = []
-    for r in entry_numbers:
+class EntryIndex:
+    """
+    Index of the words of a word list (or of the sentences of a text) by entry number, built once
+    per word list to resolve the ranges of entries linked from recordings.
+
+    Entries may be numbered in several batches, each starting with 1.
+    """
+    def __init__(self, fname, items):
+        """
+        :param items: `list` of `(word ID, entry number)` pairs, in the order of the word list.
+        """
+        self.fname = fname
+        batches, batch, leid = [], [], -1
+        for id_, eid in items:
+            if eid == 1 and batch and leid > 1:
+                # There are more sets of entry numbers starting with 1.
+                batches.append(batch)
+                batch = []
+            batch.append((id_, eid))
+            leid = eid
+        assert batch, '{}: {}'.format(fname, len(items))
+        batches.append(batch)
+
+        # The batches whose entry numbers form a contiguous range, by this range:
+        self.contiguous = {}
         if len(batches) > 1:
+            for batch in batches:
+                first = batch[0][1]
+                if all(eid == first + i for i, (_, eid) in enumerate(batch)):
+                    self.contiguous.setdefault(
+                        (first, first + len(batch) - 1), [wid for wid, _ in batch])
+
+        # Entry number -> `(position, word ID)` pairs for the words in the first batch:
+        self.entries = collections.defaultdict(list)
+        for i, (wid, eid) in enumerate(batches[0]):
+            self.entries[eid].append((i, wid))
+        self.min, self.max = min(self.entries), max(self.entries)
+
+    def __getitem__(self, interval):
+        """
+        :param interval: `(first, last)` pair of entry numbers.
+        :return: `list` of word IDs.
+        """
+        if interval in self.contiguous:
             # If a range matches exactly the entry numbers of a batch, we choose the words in this
             # batch:
-            for batch in batches:
-                if r == [eid for _, eid in batch]:
-                    wids.extend([wid for wid, _ in batch])
-                    break
-            else:
-                # Otherwise, we interpret the range as subset of the first batch:
-                for wid, eid in batches[0]:
-                    if eid in r:
-                        wids.append(wid)
+            return self.contiguous[interval]
+        # Otherwise, we chose all words with matching entry numbers from the first batch:
+        s, e = interval
+        return [wid for _, wid in sorted(
+            item for eid in range(max(s, self.min), min(e, self.max) + 1)
+            for item in self.entries.get(eid, []))]
+
+
+def linked_words(ranges, index):
+    """
+    :param ranges: Ranges of entry numbers, as given in "Word List Entries" of recording details.
+    :param index: `EntryIndex` of the linked word list.
+    :return: `list` of IDs of the linked words.
+    """
+    wids = []
+    for r in ranges.split(','):  # multiple ranges
+        if r.lower() == 'paragraph':
+            interval = (1, 1)
+        elif '-' in r:
+            interval = tuple(int(d.strip()) for d in r.split('-'))
         else:
-            # Otherwise, we just chose all words with matching entry numbers:
-            for wid, eid in batches[0]:
-                if eid in r:
-                    wids.append(wid)
-
+            interval = (int(r.strip()), int(r.strip()))
+        wids.extend(index[interval])
     return wids
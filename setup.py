@@ -19,6 +19,9 @@ setup(
         'soundfile',
         'pydub',
         'pympi-ling',
+        'numpy',
+        'Pillow',
+        'pyarrow',
     ],
     extras_require={
         'test': [
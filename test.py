@@ -1,5 +1,410 @@
+import csv
+import json
+import shutil
+import sqlite3
+import collections
+import struct
+import pathlib
+import threading
+import functools
+import http.server
+
+import pytest
+
+from cldfbench_uclaphoneticslabarchive import (
+    Dataset, SiteHandler, Normalizer, SQLiteDatabase, EntryIndex, linked_words,
+)
+from bench_parse import SITE, pages, digest
+from ucla_commands import exportcolumnar, probe, serve
+from ucla_commands.index import Index
+from ucla_commands.mediastore import MediaStore, tiff_info
+
 
 def test_valid(cldf_dataset, cldf_logger, cldf_sqlite_database):
     assert cldf_dataset.validate(log=cldf_logger)
     assert cldf_sqlite_database.query(
         "select sum(size) from mediatable where cldf_mediaType = 'audio/mpeg'")[0][0] == 6554419709
+
+
+@pytest.fixture
+def site():
+    """
+    A local stand-in for the Archive's site, serving the pages in raw/site.
+    """
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0),
+        functools.partial(SiteHandler, directory=str(Dataset().raw_dir / 'site')))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    class DS(Dataset):
+        dir = tmp_path
+    tmp_path.joinpath('raw').mkdir()
+    return DS()
+
+
+def test_crawler(site, dataset):
+    dataset.base_url = site
+    dataset.get_index_pages()
+    dataset.get_language_pages()
+    expected = Dataset().raw_dir / 'site'
+    pages = sorted(p.relative_to(dataset.site_dir) for p in dataset.site_dir.rglob('*.html'))
+    assert pages == sorted(p.relative_to(expected) for p in expected.rglob('*.html'))
+    assert all(
+        dataset.site_dir.joinpath(p).read_bytes() == expected.joinpath(p).read_bytes()
+        for p in pages)
+    assert not list(dataset.site_dir.rglob('*.new')) and not list(dataset.site_dir.rglob('*.tmp'))
+
+    # Re-validating the pages results in "304 Not Modified" responses:
+    shutil.rmtree(dataset.site_dir / 'ABK')
+    dataset.refresh, dataset.changed = True, set()
+    dataset.get_index_pages()
+    dataset.get_language_pages()
+    assert dataset.changed == {'ABK'}
+
+
+def test_parse_language_dirs(dataset):
+    for dname in ['ABQ', 'ACE']:
+        shutil.copytree(Dataset().raw_dir / 'site' / dname, dataset.site_dir / dname)
+    assert dataset.parse_language_dirs({}) == 2
+    index = dataset.recordings_dir / 'index.json'
+    assert [k.split('|')[1] for k, _ in dataset.iter_recordings()] == ['ABQ', 'ACE']
+
+    dataset.changed = {'ACE'}
+    assert dataset.parse_language_dirs(json.loads(index.read_text(encoding='utf8'))) == 1
+    # A different version of the code invalidates all parsed data:
+    assert dataset.parse_language_dirs({'code': 'x', 'keys': []}) == 2
+
+
+def test_parsed_pages():
+    """
+    The rows extracted from all pages in raw/site are the same as with the original implementation.
+    """
+    expected = json.loads(pathlib.Path(__file__).parent.joinpath(
+        'test_data', 'parsed_pages.json').read_text(encoding='utf8'))
+    assert {p.relative_to(SITE).as_posix(): digest(p) for p in pages()} == expected
+
+
+# Two batches of entry numbers, 1-3 and 1-2:
+ITEMS = [('a1', 1), ('a2', 2), ('a3', 3), ('b1', 1), ('b2', 2)]
+
+
+@pytest.mark.parametrize(
+    'ranges,items,expected',
+    [
+        ('1-3', ITEMS[:3], ['a1', 'a2', 'a3']),
+        ('2', ITEMS[:3], ['a2']),
+        ('1, 3', ITEMS[:3], ['a1', 'a3']),
+        ('3-1', ITEMS[:3], []),
+        ('Paragraph', ITEMS[:3], ['a1']),
+        # A range matching exactly the entry numbers of a batch selects this batch:
+        ('1-2', ITEMS, ['b1', 'b2']),
+        ('1-3,1-2', ITEMS, ['a1', 'a2', 'a3', 'b1', 'b2']),
+        # Other ranges select from the first batch:
+        ('2-3', ITEMS, ['a2', 'a3']),
+        ('2-10', ITEMS, ['a2', 'a3']),
+    ]
+)
+def test_linked_words(ranges, items, expected):
+    assert linked_words(ranges, EntryIndex('x.html', items)) == expected
+
+
+@pytest.fixture(scope='module')
+def normalizer():
+    return Normalizer(json.loads(pathlib.Path(__file__).parent.joinpath(
+        'etc', 'normalization.json').read_text(encoding='utf8')))
+
+
+@pytest.mark.parametrize(
+    'method,value,expected,fired',
+    [
+        ('form', 'ba', 'ba', {}),
+        ('form', '----', 'NA', {'Form: ----': 1}),
+        ('contents', 'Wordlist and running speech', ['continuous speech', 'word list'],
+         {'Recording Contents: running speech': 1, 'Recording Contents: *wordlist*': 1}),
+        ('contents', 'Wordlist (partial), story', ['story', 'word list (partial)'],
+         {'Recording Contents: *wordlist*': 1}),
+        ('contents', 'Word list', ['word list'], {}),
+        ('date', 'June 1970', ('June 1970', 1970), {}),
+        ('date', 'Date unspecified', (None, None), {'Recording Date: Date unspecified': 1}),
+        ('date', 'Month Unknown', (None, None), {'Recording Date: *unknown': 1}),
+        ('orm', 'Reel Tape, Cassette Tape', ['reel tape', 'cassette tape'],
+         {'Original Recording Medium: Reel Tape, Cassette Tape': 1}),
+        ('orm', 'reel tape', ['reel tape'], {}),
+        ('orm', 'Unknown', None, {'Original Recording Medium: Unknown': 1}),
+    ]
+)
+def test_normalizer(normalizer, method, value, expected, fired):
+    counts = collections.Counter()
+    assert getattr(normalizer, method)(value, counts) == expected
+    assert counts == fired
+
+
+def test_normalizer_details(normalizer):
+    counts = collections.Counter()
+    res = normalizer.details({
+        'Recording Contents': 'Wordlist',
+        'Recording Location': 'UNKNOWN',
+        'Fieldworkers': 'P. Ladefoged',
+        'Speakers': 'unknown',
+        'Speaker Origin': 'Speaker origin unknown',
+    }, counts)
+    assert res['contents'] == ['word list']
+    assert res['location'] is None
+    assert res['Contributor'] == 'P. Ladefoged'
+    assert res['speakers'] is None and res['speaker_origin'] is None
+    assert res['date'] is None and res['dialect'] is None
+    assert counts == {
+        'Recording Contents: *wordlist*': 1,
+        'Recording Location: unknown': 1,
+        'Speakers: unknown': 1,
+        'Speaker Origin: Speaker origin unknown': 1,
+    }
+    # Location values starting with "unknown" carry information and are kept:
+    assert normalizer.details(
+        {'Recording Location': 'Unknown; speaker from Phnom Penh'},
+        collections.Counter())['location'] == 'Unknown; speaker from Phnom Penh'
+
+
+def riff(*chunks):
+    data = b'WAVE' + b''.join(
+        cid + struct.pack('<I', len(body)) + body + b'\0' * (len(body) % 2) for cid, body in chunks)
+    return b'RIFF' + struct.pack('<I', len(data)) + data
+
+
+def fmt_chunk(tag, channels, sample_rate, bits, subformat=None):
+    block_align = channels * bits // 8
+    res = struct.pack(
+        '<HHIIHH', tag, channels, sample_rate, sample_rate * block_align, block_align, bits)
+    if subformat:  # WAVE_FORMAT_EXTENSIBLE
+        res += struct.pack('<HHIH', 22, bits, 0, subformat) + b'\0' * 14
+    return b'fmt ', res
+
+
+@pytest.mark.parametrize(
+    'wav,expected',
+    [
+        # PCM16, mono, 1 second:
+        (riff(fmt_chunk(1, 1, 8000, 16), (b'data', b'\0' * 16000)),
+         dict(channels=1, sample_rate=8000, bits_per_sample=16, format='pcm',
+              data_offset=44, data_size=16000, length=1.0)),
+        # PCM24, stereo, with a chunk of odd size - i.e. padded - before the data:
+        (riff(fmt_chunk(1, 2, 44100, 24), (b'LIST', b'x' * 5), (b'data', b'\0' * 26460)),
+         dict(channels=2, sample_rate=44100, bits_per_sample=24, format='pcm',
+              data_offset=58, data_size=26460, length=0.1)),
+        # 32 bit float, as WAVE_FORMAT_EXTENSIBLE:
+        (riff(fmt_chunk(0xFFFE, 1, 16000, 32, subformat=3), (b'data', b'\0' * 32000)),
+         dict(channels=1, sample_rate=16000, bits_per_sample=32, format='float',
+              data_offset=68, data_size=32000, length=0.5)),
+    ]
+)
+def test_wav_info(tmp_path, wav, expected):
+    p = tmp_path / 'test.wav'
+    p.write_bytes(wav)
+    assert probe.wav_info(probe.LocalFile(p)) == expected
+
+
+def test_wav_info_errors(tmp_path):
+    p = tmp_path / 'test.wav'
+    # A data size of 0xFFFFFFFF - as written by streaming tools - is clipped to the file size:
+    p.write_bytes(riff(fmt_chunk(1, 1, 8000, 16))
+                  + b'data' + struct.pack('<I', 0xFFFFFFFF) + b'\0' * 800)
+    assert probe.wav_info(probe.LocalFile(p))['length'] == 0.05
+    for content in [
+        b'RIFX' + b'\0' * 40,
+        riff(fmt_chunk(1, 1, 8000, 16)),
+        riff((b'data', b'\0' * 100)),
+    ]:
+        p.write_bytes(content)
+        with pytest.raises(ValueError):
+            probe.wav_info(probe.LocalFile(p))
+
+
+# MPEG 1 Layer III, 128 kbit/s, 44100 Hz, stereo - frames of 417 bytes:
+MP3_HEADER = bytes([0xFF, 0xFB, 0x90, 0x00])
+
+
+def test_mpeg_frame():
+    assert probe.mpeg_frame(MP3_HEADER) == dict(
+        version=1, layer=3, bitrate=128000, sample_rate=44100, channels=2, samples=1152,
+        frame_length=417)
+    # MPEG 2 Layer III, 64 kbit/s, 22050 Hz, mono, padded:
+    assert probe.mpeg_frame(bytes([0xFF, 0xF3, 0x82, 0xC0])) == dict(
+        version=2, layer=3, bitrate=64000, sample_rate=22050, channels=1, samples=576,
+        frame_length=209)
+    assert probe.mpeg_frame(b'ID3\x04') is None
+    assert probe.mpeg_frame(bytes([0xFF, 0xFB, 0xF0, 0x00])) is None  # Invalid bitrate.
+    assert probe.mpeg_frame(bytes([0xFF, 0xFB, 0x9C, 0x00])) is None  # Invalid sample rate.
+
+
+def test_mp3_info(tmp_path):
+    p = tmp_path / 'test.mp3'
+    frame = MP3_HEADER + b'\0' * 413
+    id3 = b'ID3\x04\x00\x00' + bytes([0, 0, 1, 0]) + b'\0' * 128  # Tag with 128 bytes.
+    # CBR: The length is computed from the file size.
+    p.write_bytes(id3 + b'\x00\xff' + frame * 10)
+    assert probe.mp3_info(probe.LocalFile(p)) == dict(
+        channels=2, sample_rate=44100, bitrate=128000, length=0.261)
+
+    # VBR: The number of frames is read from the Xing header.
+    xing = MP3_HEADER + b'\0' * 32 + b'Xing' + struct.pack('>II', 1, 100)
+    p.write_bytes(xing + b'\0' * (417 - len(xing)) + frame * 10)
+    assert probe.mp3_info(probe.LocalFile(p))['length'] == 2.612
+
+    # A single frame header is not taken as the start of the audio data:
+    p.write_bytes(MP3_HEADER + b'\0' * 1000)
+    with pytest.raises(ValueError):
+        probe.mp3_info(probe.LocalFile(p))
+
+
+@pytest.mark.parametrize(
+    'header,expected',
+    [
+        ('bytes=0-99', (0, 100)),
+        ('bytes=100-', (100, 1000)),
+        ('bytes=-100', (900, 1000)),
+        ('bytes=-2000', (0, 1000)),
+        ('bytes=990-2000', (990, 1000)),
+        (' bytes=0-0 ', (0, 1)),
+        # Unsupported headers - the full content is sent:
+        ('bytes=-', None),
+        ('bytes=0-9,20-29', None),
+        ('items=0-9', None),
+    ]
+)
+def test_parse_range(header, expected):
+    assert serve.parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize('header', ['bytes=1000-', 'bytes=1000-1001', 'bytes=10-5', 'bytes=-0'])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(ValueError):
+        serve.parse_range(header, 1000)
+
+
+def test_sqlite_database_open(tmp_path):
+    cldf = Dataset().cldf_reader()
+    p = tmp_path / 'db.sqlite'
+    with pytest.raises(ValueError):
+        SQLiteDatabase.open(p, cldf)
+    SQLiteDatabase(p, cldf).db.close()
+    db = SQLiteDatabase.open(p, cldf)
+    assert db.fingerprint('x') is None
+    with pytest.raises(sqlite3.OperationalError):
+        db.db.execute("DELETE FROM _meta")
+    db.db.close()
+
+    with sqlite3.connect(str(p)) as conn:
+        conn.execute("UPDATE _meta SET value = 'x' WHERE key = 'schema'")
+    conn.close()
+    with pytest.raises(ValueError):
+        SQLiteDatabase.open(p, cldf)
+    # Opening read-only doesn't re-create the database:
+    with sqlite3.connect(str(p)) as conn:
+        assert conn.execute("SELECT value FROM _meta WHERE key = 'schema'").fetchone()[0] == 'x'
+    conn.close()
+
+
+def test_arrow_table(tmp_path):
+    from pycldf import Generic
+
+    cldf = Generic.in_dir(tmp_path)
+    cldf.add_component('MediaTable')
+    url = 'http://archive.phonetics.ucla.edu/Language/EMA/ema_word-list_1962_01.wav'
+    cldf.write(MediaTable=[dict(ID='m', Media_Type='audio/x-wav', Download_URL=url)])
+    table = exportcolumnar.arrow_table(Generic.from_metadata(
+        tmp_path / 'Generic-metadata.json')['MediaTable'])
+    assert table.column('Download_URL').to_pylist() == [url]
+
+
+def test_index(dataset):
+    dataset.cldf_dir.mkdir()
+    md = Dataset().cldf_dir / 'Wordlist-metadata.json'
+    shutil.copy(str(md), str(dataset.cldf_dir))
+    rows = {
+        'forms.csv': [
+            dict(ID='f1', Language_ID='L', Parameter_ID='eye', Form='a', original_data='{}'),
+            dict(ID='f2', Language_ID='L', Parameter_ID='ear', Form='b', original_data='{}')],
+        'examples.csv': [dict(ID='e1', Language_ID='L', Primary_Text='a b')],
+        'media.csv': [
+            dict(ID='m1', Media_Type='audio/x-wav', Download_URL='http://example.org/m1.wav'),
+            dict(ID='m2', Media_Type='audio/mpeg', Download_URL='http://example.org/m2.mp3')],
+        'contributions.csv': [
+            dict(ID='L-1', Language_ID='L', Position='1', Media_IDs='m1 m2', Form_IDs='f1 f2'),
+            dict(ID='L-2', Language_ID='L', Position='2', Media_IDs='m2', Text_IDs='e1')],
+    }
+    for table in json.loads(md.read_text(encoding='utf8'))['tables']:
+        with dataset.cldf_dir.joinpath(table['url']).open('w', encoding='utf8', newline='') as f:
+            writer = csv.DictWriter(f, [c['name'] for c in table['tableSchema']['columns']])
+            writer.writeheader()
+            writer.writerows(rows.get(table['url'], []))
+
+    index = Index(dataset)
+    assert index.recordings('f1') == [('f1', 'L-1')]
+    assert index.recordings('e1') == [('e1', 'L-2')]
+    assert index.recordings(parameter='ear') == [('f2', 'L-1')]
+    assert index.find_media('e1') == [('e1', 'L-2', 'm2')]
+    assert index.find_media(parameter='eye', media_type='audio/x-wav') == [('f1', 'L-1', 'm1')]
+    assert [m['id'] for m in index.media('L-1')] == ['m1', 'm2']
+    with pytest.raises(ValueError):
+        index.recordings()
+
+
+def tiff(pixels, planar):
+    """
+    A little-endian, uncompressed 8 bit TIFF file, with one strip per plane.
+
+    :param pixels: `list` of rows of `list`s of samples per pixel.
+    """
+    height, width, spp = len(pixels), len(pixels[0]), len(pixels[0][0])
+    if planar:
+        strips = [bytes(p[i] for row in pixels for p in row) for i in range(spp)]
+    else:
+        strips = [bytes(v for row in pixels for p in row for v in p)]
+    n = 9  # number of tags
+    # Header, image file directory, strip offsets and strip byte counts, strips:
+    offsets_at = 8 + 2 + 12 * n + 4
+    counts_at = offsets_at + 4 * len(strips)
+    data_at = counts_at + 4 * len(strips)
+    offsets = [data_at + sum(len(s) for s in strips[:i]) for i in range(len(strips))]
+
+    def entry(tag, value, type_=3):
+        return struct.pack('<HHI', tag, type_, 1) + struct.pack('<HH' if type_ == 3 else '<I', *(
+            [value, 0] if type_ == 3 else [value]))
+
+    def strip_entry(tag, values, at):
+        if len(values) == 1:
+            return entry(tag, values[0], type_=4)
+        return struct.pack('<HHII', tag, 4, len(values), at)
+
+    ifd = struct.pack('<H', n) + b''.join([
+        entry(256, width),
+        entry(257, height),
+        entry(258, 8),
+        entry(259, 1),
+        entry(262, 2 if spp == 3 else 1),  # RGB or greyscale
+        strip_entry(273, offsets, offsets_at),
+        entry(277, spp),
+        strip_entry(279, [len(s) for s in strips], counts_at),
+        entry(284, 2 if planar else 1),
+    ]) + struct.pack('<I', 0)
+    return b'II*\x00' + struct.pack('<I', 8) + ifd + \
+        struct.pack('<{}I'.format(len(strips)), *offsets) + \
+        struct.pack('<{}I'.format(len(strips)), *[len(s) for s in strips]) + b''.join(strips)
+
+
+@pytest.mark.parametrize('planar', [False, True])
+def test_image(dataset, planar):
+    pixels = [[[1, 2, 3], [4, 5, 6]], [[7, 8, 9], [10, 11, 12]], [[13, 14, 15], [16, 17, 18]]]
+    d = dataset.raw_dir / 'media' / 'ABC'
+    d.mkdir(parents=True)
+    d.joinpath('abc.tif').write_bytes(tiff(pixels, planar))
+    info = tiff_info(probe.LocalFile(d / 'abc.tif'))
+    assert info['planar_configuration'] == (2 if planar else 1)
+    assert (info['width'], info['height'], info['samples_per_pixel']) == (2, 3, 3)
+    assert MediaStore(dataset).image('abc_tif').tolist() == pixels
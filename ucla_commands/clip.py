@@ -0,0 +1,40 @@
+"""
+Extract the audio of a word from the WAV file of a word list recording.
+
+This requires the word boundaries in the recording to be detected first, running
+`cldfbench ucla.segment`.
+"""
+import pathlib
+
+import soundfile
+from clldutils.clilib import ParserError
+
+from cldfbench_uclaphoneticslabarchive import Dataset
+from .index import Index
+from .segment import Clips
+
+
+def register(parser):
+    parser.add_argument('form', help='Form ID.')
+    parser.add_argument(
+        '--recording',
+        default=None,
+        help='Recording ID. Only needed for forms which appear in more than one recording.')
+    parser.add_argument(
+        '--output',
+        type=pathlib.Path,
+        default=None,
+        help='Path of the WAV file to write (default: <form>.wav).')
+
+
+def run(args):
+    ds = Dataset()
+    clips = Clips(ds)
+    rids = [args.recording] if args.recording else Index(ds).form_recordings(args.form)
+    rids = [rid for rid in rids if args.form in clips.offsets(rid)]
+    if not rids:
+        raise ParserError('No clip found for form {}; run ucla.segment first'.format(args.form))
+    data, samplerate = clips.read(rids[0], args.form)
+    out = args.output or pathlib.Path('{}.wav'.format(args.form))
+    soundfile.write(str(out), data, samplerate)
+    args.log.info('Wrote {:.2f}s of {} to {}'.format(len(data) / samplerate, rids[0], out))
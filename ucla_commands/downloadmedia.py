@@ -1,12 +1,17 @@
 """
 Download media files from the UCLA phonetics lab archive website.
 """
-import urllib.request
+import os
+import time
+import threading
 
 from clldutils.jsonlib import load
-from csvw.datatypes import anyURI
 
-from cldfbench_uclaphoneticslabarchive import Dataset
+from cldfbench_uclaphoneticslabarchive import Dataset, Fetcher
+from .index import Index
+
+# Files may be requested by concurrent calls of `download`, thus we serialize access per file.
+LOCKS = {}
 
 
 def register(parser):
@@ -14,35 +19,124 @@ def register(parser):
     parser.add_argument(
         '--recording',
         help="ID of a recording for which to retrieve media files")
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help="Number of files to download in parallel")
 
 
 def run(args):
     ds = Dataset()
-    download(ds, args.recording, args.suffix)
+    download(ds, args.recording, args.suffix, workers=args.workers)
+
+
+class Progress:
+    """
+    Keeps track of the downloaded bytes, reporting throughput and ETA at most every `interval`
+    seconds.
+
+    `done` counts the bytes of the (partial) files on disk, `transferred` the bytes downloaded by
+    this run - which determine the throughput.
+    """
+    def __init__(self, total, interval=5):
+        self.total = total
+        self.done = 0
+        self.transferred = 0
+        self.interval = interval
+        self.start = self.last = time.time()
+        self._lock = threading.Lock()
+
+    def resume(self, n):
+        """
+        `n` bytes of a file have been downloaded by a previous run.
+        """
+        with self._lock:
+            self.done += n
+
+    def discard(self, n):
+        """
+        `n` bytes of a partial file have been discarded, i.e. must be downloaded again.
+        """
+        with self._lock:
+            self.done -= n
 
+    def update(self, n):
+        with self._lock:
+            self.done += n
+            self.transferred += n
+            now = time.time()
+            if now - self.last > self.interval:
+                self.last = now
+                rate = self.transferred / (now - self.start)
+                print('{:.1f}/{:.1f} MB, {:.2f} MB/s, ETA {:.0f}s'.format(
+                    self.done / 1e6,
+                    self.total / 1e6,
+                    rate / 1e6,
+                    (self.total - self.done) / rate if rate else 0))
 
-def download(ds, recording=None, suffix=None):
+
+def fetch_media(fetcher, url, target, size, progress):
+    """
+    Download a media file to `<target>.part` - resuming an incomplete download via HTTP Range
+    requests - and rename the file to `target` once its size is verified.
+    """
+    part = target.parent / '{}.part'.format(target.name)
+
+    def get():
+        expected, offset = size, part.stat().st_size if part.exists() else 0
+        if size and offset > size:
+            part.unlink()
+            progress.discard(offset)
+            offset = 0
+        if not (size and offset == size):
+            res = fetcher.request(url, headers={'Range': 'bytes={}-'.format(offset)} if offset else None)
+            if offset and res.status != 206:
+                # The server ignored the Range header and sent the full content, i.e. the file
+                # is rewritten from the start.
+                progress.discard(offset)
+                offset = 0
+            if not expected and res.getheader('Content-Length'):
+                expected = offset + int(res.getheader('Content-Length'))
+            with part.open('ab' if offset else 'wb') as f:
+                while True:
+                    chunk = res.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    progress.update(len(chunk))
+        if expected and part.stat().st_size != expected:
+            raise IOError('Size mismatch for {}: expected {}, got {}'.format(
+                url, expected, part.stat().st_size))
+        os.replace(part, target)
+
+    with LOCKS.setdefault(target, threading.Lock()):
+        if not target.exists():
+            print(url)
+            if part.exists():
+                progress.resume(part.stat().st_size)
+            fetcher.retry(get)
+    return target
+
+
+def download(ds, recording=None, suffix=None, workers=4):
     media = ds.raw_dir / 'media'
-    if not media.exists():
-        media.mkdir()
+    media.mkdir(exist_ok=True)
     selection = None
     target = None
     if recording:
-        for rec in ds.cldf_reader().objects('ContributionTable'):
-            if rec.id == recording:
-                selection = [
-                    anyURI.to_string(f.cldf.downloadUrl) for f in rec.all_related('mediaReference')]
-    for d, (url, _, _) in load(ds.etc_dir / 'urls.json').items():
-        if selection and url not in selection:
+        selection = {m['url'] for m in Index(ds).media(recording)}
+    todo = []
+    for d, (url, size, _) in load(ds.etc_dir / 'urls.json').items():
+        if selection is not None and url not in selection:
             continue
         if url and (not suffix or (d.split('.')[-1] == suffix)):
             target = media.joinpath(d)
             if not target.exists():
-                print(url)
-                try:
-                    urllib.request.urlretrieve(url, target)
-                except:
-                    if target.exists():
-                        target.unlink()
-                    raise
+                target.parent.mkdir(exist_ok=True)
+                todo.append((url, target, size))
+
+    progress = Progress(sum(size or 0 for _, _, size in todo))
+    fetcher = Fetcher(workers=workers)
+    list(fetcher.map(lambda item: fetch_media(fetcher, *item, progress), todo))
     return target
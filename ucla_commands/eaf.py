@@ -1,27 +1,127 @@
 """
-Seed an ELAN file with the wordlist data for a particular recording.
+Seed ELAN files with the wordlist data for recordings.
+
+Recordings can be specified by ID, by language ID - selecting all recordings of word lists for
+the language - or as "all", selecting all recordings of word lists.
 """
+import os
+import shutil
+import hashlib
 import pathlib
+import tempfile
+import threading
+import subprocess
 
+from clldutils.jsonlib import dump
 from cldfbench_uclaphoneticslabarchive import Dataset
 from pydub import AudioSegment
-from soundfile import SoundFile
+import soundfile
 from pympi import Eaf
 
 from .downloadmedia import download
+from .index import Index, Pool, select
+from .segment import Clips
+
+# The cache of decoded WAV files is shared by the threads seeding ELAN files:
+CACHE_LOCK = threading.Lock()
+
+
+def decode(p, out):
+    """
+    Decode an audio file to WAV, streaming the data to disk using the converter configured for
+    pydub, i.e. without reading the decoded audio into memory.
+    """
+    subprocess.run(
+        [AudioSegment.converter, '-nostdin', '-loglevel', 'error', '-y', '-i', str(p), '-f', 'wav',
+         str(out)],
+        check=True)
+    return out
+
+
+def evict(cache_dir, max_size):
+    """
+    Delete the least recently used files from `cache_dir` until their total size is below
+    `max_size`.
+    """
+    files = sorted((p.stat().st_mtime, p.stat().st_size, p) for p in cache_dir.glob('*.wav'))
+    total = sum(size for _, size, _ in files)
+    for _, size, p in files[:-1]:  # We never evict the most recently used file.
+        if total <= max_size:
+            break
+        p.unlink()
+        total -= size
+
+
+def mp3_to_wav(p, out, cache_dir=None, max_cache_size=2 * 10 ** 9):
+    """
+    Convert an MP3 file to WAV.
+
+    If `cache_dir` is specified, decoded files are cached there, keyed by the SHA256 digest of the
+    MP3 data. The cache is limited to `max_cache_size` bytes, evicting least recently used files.
+    """
+    if not cache_dir:
+        return decode(p, out)
 
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    sha256 = hashlib.sha256()
+    with p.open('rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    cached = cache_dir / '{}.wav'.format(sha256.hexdigest())
+    # Looking up, linking and evicting files must not be interleaved across threads - otherwise a
+    # file could be evicted between the lookup and the linking.
+    with CACHE_LOCK:
+        if cached.exists():
+            os.utime(cached)  # Mark as recently used.
+            return link(cached, out)
 
-def mp3_to_wav(p, out):
-    sound = AudioSegment.from_mp3(str(p))
-    sound.export(str(out), format="wav")
+    fd, tmp = tempfile.mkstemp(dir=str(cache_dir), suffix='.tmp')
+    os.close(fd)
+    decode(p, tmp)
+    with CACHE_LOCK:
+        os.replace(tmp, cached)
+        link(cached, out)
+        evict(cache_dir, max_cache_size)
     return out
 
 
-def make_eaf(rec, audio, forms):
+def link(src, out):
+    if out.exists():
+        out.unlink()
+    try:
+        os.link(src, out)
+    except OSError:  # Hard links are not supported across file systems.
+        shutil.copyfile(src, out)
+    return out
+
+
+def make_eaf(rid,
+             audio,
+             forms,
+             outdir=pathlib.Path('.'),
+             length=None,
+             cache_dir=None,
+             max_cache_size=2 * 10 ** 9,
+             offsets=None):
+    """
+    :param rid: Recording ID.
+    :param audio: Path of the audio file of the recording.
+    :param forms: `list` of `dict`s with keys `id` and `original_data`, as returned by \
+    `Index.forms`.
+    :param outdir: Directory to write the ELAN file - and the audio converted to WAV - to.
+    :param length: Length of the audio in seconds, if known (e.g. from `MediaTable`).
+    :param cache_dir: Directory to cache decoded MP3 files in.
+    :param max_cache_size: Maximal size of the cache in bytes.
+    :param offsets: `dict` mapping form IDs to `(start, end)` offsets in seconds, as detected by \
+    `ucla.segment`. If not given, the audio is split into slices of equal length.
+    """
+    if not forms:
+        raise ValueError('No forms linked to recording {}'.format(rid))
     if audio.suffix == '.mp3':
-        audio = mp3_to_wav(audio, pathlib.Path('{}.wav'.format(rec.id)))
-    f = SoundFile(str(audio))
-    duration = f.frames / f.samplerate
+        audio = mp3_to_wav(
+            audio, outdir / '{}.wav'.format(rid), cache_dir=cache_dir, max_cache_size=max_cache_size)
+    # If the length is not known, we read it from the header of the WAV file:
+    duration = length or soundfile.info(str(audio)).duration
     eaf = Eaf()
     eaf.add_linked_file(str(audio))
     eaf.add_tier('words')
@@ -29,19 +129,26 @@ def make_eaf(rec, audio, forms):
 
     dpw = duration * 1000 // len(forms)
     for i, form in enumerate(forms):
-        eaf.add_annotation('words', int(i * dpw), int((i + 1) * dpw), form.id)
-        for k, v in form.data['original_data'].items():
+        if offsets and form['id'] in offsets:
+            start, end = (int(o * 1000) for o in offsets[form['id']])
+        else:
+            start, end = int(i * dpw), int((i + 1) * dpw)
+        eaf.add_annotation('words', start, end, form['id'])
+        for k, v in form['original_data'].items():
             if k not in tiers:
                 eaf.add_tier(k, parent='words')
                 tiers.add(k)
-            eaf.add_annotation(k, int(i * dpw), int((i + 1) * dpw), v)
-    res = pathlib.Path('{}.eaf'.format(rec.id))
+            eaf.add_annotation(k, start, end, v)
+    res = outdir / '{}.eaf'.format(rid)
     eaf.to_file(str(res))
     return res, audio
 
 
 def register(parser):
-    parser.add_argument('recording')
+    parser.add_argument(
+        'recording',
+        nargs='+',
+        help='Recording ID, language ID or "all".')
     parser.add_argument(
         '--mp3',
         action='store_true',
@@ -49,14 +156,60 @@ def register(parser):
         help='By default, the wav file of a recording is linked to the ELAN file. For quicker '
              'downloads the mp3 file might be preferable. In that case, add this option.'
     )
+    parser.add_argument(
+        '--output',
+        type=pathlib.Path,
+        default=pathlib.Path('.'),
+        help='Directory to write ELAN files to.')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Number of recordings to process in parallel.')
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=2000,
+        help='Maximal size in MB of the cache of WAV files decoded from MP3 in raw/cache/wav/.')
 
 
 def run(args):
     ds = Dataset()
-    cldf = ds.cldf_reader()
-    for rec in cldf.objects('ContributionTable'):
-        if rec.id == args.recording:
-            audio = download(ds, recording=args.recording, suffix='mp3' if args.mp3 else 'wav')
-            eaf, wav = make_eaf(rec, audio, rec.all_related('formReference'))
-            break
-    args.log.info('Created ELAN file {} with linked audio {}'.format(eaf, wav))
+    index = Index(ds)
+    rids = select(index, args.recording)
+    # We read the data upfront, because the SQLite connection cannot be shared between threads.
+    forms = {rid: index.forms(rid) for rid in rids}
+    lengths = {m['name']: m['length'] for rid in rids for m in index.media(rid)}
+    clips = Clips(ds)
+    offsets = {rid: clips.offsets(rid) for rid in rids}
+    if not args.output.exists():
+        args.output.mkdir(parents=True)
+
+    def seed(rid):
+        audio = download(
+            ds, recording=rid, suffix='mp3' if args.mp3 else 'wav', workers=1)
+        if not audio:
+            raise ValueError('No audio file for recording {}'.format(rid))
+        return make_eaf(
+            rid,
+            audio,
+            forms[rid],
+            outdir=args.output,
+            length=lengths.get(audio.name),
+            cache_dir=ds.cache_dir / 'wav',
+            max_cache_size=args.cache_size * 10 ** 6,
+            offsets=offsets[rid])
+
+    manifest, pool = {}, Pool(args.log, workers=args.workers)
+    for rid, (eaf, wav) in pool.map(seed, {rid: (rid,) for rid in rids}):
+        manifest[rid] = dict(eaf=str(eaf), audio=str(wav))
+        args.log.info('Created ELAN file {} with linked audio {}'.format(eaf, wav))
+    manifest.update({rid: dict(error=str(e)) for rid, e in pool.failed.items()})
+    manifest = {rid: manifest[rid] for rid in rids}
+    if len(rids) > 1:
+        dump(manifest, args.output / 'manifest.json', indent=2)
+        args.log.info('{} ELAN files created, {} failures, see {}'.format(
+            sum(1 for v in manifest.values() if 'eaf' in v),
+            len(pool.failed),
+            args.output / 'manifest.json'))
+    pool.check('Seeding ELAN files', len(rids))
@@ -0,0 +1,108 @@
+"""
+Export the CLDF tables to Parquet files, for analysis with columnar data tools.
+
+Columns are typed according to the CLDF metadata, list-valued columns (e.g. `Media_IDs`) are
+exported as lists and the JSON objects in `original_data` columns are expanded into structs.
+"""
+import json
+import pathlib
+import collections
+
+import pyarrow
+import pyarrow.parquet
+from csvw.datatypes import anyURI
+
+from cldfbench_uclaphoneticslabarchive import Dataset
+
+TYPES = {
+    'integer': pyarrow.int64(),
+    'decimal': pyarrow.float64(),
+    'float': pyarrow.float64(),
+    'double': pyarrow.float64(),
+    'boolean': pyarrow.bool_(),
+}
+
+
+def register(parser):
+    parser.add_argument(
+        '--output',
+        type=pathlib.Path,
+        default=pathlib.Path('parquet'),
+        help='Directory to write the Parquet files to.')
+
+
+def run(args):
+    cldf = Dataset().cldf_reader()
+    if not args.output.exists():
+        args.output.mkdir(parents=True)
+    for table in cldf.tables:
+        res = args.output / '{}.parquet'.format(pathlib.Path(table.url.string).stem)
+        data = arrow_table(table)
+        pyarrow.parquet.write_table(data, str(res))
+        args.log.info('{}: {} rows'.format(res, data.num_rows))
+
+
+def is_int(v):
+    return isinstance(v, str) and v.lstrip('-').isdigit() and str(int(v)) == v
+
+
+def json_column(values):
+    """
+    Convert a column of JSON objects to a struct array with one field per key. Fields are typed
+    as integers if all values are integer strings - such as `Entry` in word lists.
+    """
+    keys = collections.OrderedDict()
+    for v in values:
+        for k, vv in (v or {}).items() if isinstance(v, dict) else []:
+            keys[k] = keys.get(k, True) and (vv is None or is_int(vv))
+    if not keys or not all(isinstance(v, dict) or v is None for v in values):
+        # Parquet has no representation for structs without fields.
+        return pyarrow.array([None if v is None else json.dumps(v) for v in values], pyarrow.string())
+    fields = [pyarrow.field(k, pyarrow.int64() if integer else pyarrow.string())
+              for k, integer in keys.items()]
+    return pyarrow.array(
+        [None if v is None else {
+            k: int(vv) if (keys[k] and vv is not None) else (
+                vv if vv is None or isinstance(vv, str) else json.dumps(vv))
+            for k, vv in v.items()} for v in values],
+        pyarrow.struct(fields))
+
+
+def convert(v, func):
+    if v is None:
+        return None
+    if isinstance(v, list):
+        return [func(vv) for vv in v]
+    return func(v)
+
+
+def arrow_table(table):
+    """
+    Convert a CLDF table to a `pyarrow.Table`.
+    """
+    cols = table.tableSchema.columns
+    values = collections.defaultdict(list)
+    for row in table:
+        for col in cols:
+            values[col.name].append(row.get(col.name))
+
+    arrays, fields = [], []
+    for col in cols:
+        base = col.datatype.base if col.datatype else 'string'
+        if base == 'json':
+            array = json_column(values[col.name])
+        else:
+            type_ = TYPES.get(base, pyarrow.string())
+            # Decimals are exported as floats, other types as strings - URLs, which are read as
+            # `rfc3986.URIReference`, in their serialized form:
+            func = anyURI.to_string if base == 'anyURI' \
+                else {pyarrow.string(): str, pyarrow.float64(): float}.get(type_)
+            array = pyarrow.array(
+                [convert(v, func) for v in values[col.name]] if func else values[col.name],
+                pyarrow.list_(type_) if col.separator else type_)
+        arrays.append(array)
+        fields.append(pyarrow.field(
+            col.name,
+            array.type,
+            metadata={'propertyUrl': col.propertyUrl.uri} if col.propertyUrl else None))
+    return pyarrow.Table.from_arrays(arrays, schema=pyarrow.schema(fields))
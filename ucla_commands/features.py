@@ -0,0 +1,288 @@
+"""
+Extract acoustic features - log mel spectrogram, MFCCs and pitch - from the WAV files of
+recordings.
+
+Features are computed for frames of 25ms (40ms for pitch) every 10ms and stored as `.npy` arrays
+in raw/cache/features/<MEDIA_ID>/, so they can be loaded as memory maps - e.g. for the words of a
+recording, located by `cldfbench ucla.segment` - without decoding audio again.
+"""
+import shutil
+
+import numpy
+from numpy.lib.format import open_memmap
+from clldutils.jsonlib import dump, load
+
+from cldfbench_uclaphoneticslabarchive import Dataset
+from .downloadmedia import download
+from .index import Index, Pool, select
+from .mediastore import MediaStore, wav_samples
+from .segment import Clips
+
+PARAMS = dict(
+    hop=0.01,
+    window=0.025,
+    pitch_window=0.04,
+    mels=40,
+    mfccs=13,
+    f0_min=60,
+    f0_max=400,
+    voicing_threshold=0.45,
+    octave_cost=0.02,
+)
+FEATURES = ['melspec', 'mfcc', 'f0']
+
+
+def register(parser):
+    parser.add_argument(
+        'recording',
+        nargs='+',
+        help='Recording ID, language ID or "all". WAV files which have not been downloaded yet are '
+             'downloaded.')
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=None,
+        help='Number of recordings to process in parallel (default: number of CPUs).')
+
+
+def run(args):
+    ds = Dataset()
+    index = Index(ds)
+    rids = select(index, args.recording)
+
+    store, clips, features = MediaStore(ds), Clips(ds), Features(ds)
+    pool = Pool(args.log, workers=args.processes, processes=True)
+    todo = {}
+    for rid in rids:
+        wavs = [m['id'] for m in index.media(rid) if m['media_type'] == 'audio/x-wav']
+        if not wavs:
+            args.log.warning('No WAV file for recording {}'.format(rid))
+            continue
+        if wavs[0] not in store:
+            download(ds, recording=rid, suffix='wav', workers=1)
+        try:
+            info = store.info(wavs[0])
+        except KeyError as e:
+            pool.fail(rid, e)
+            continue
+        if not info.get('wav'):
+            pool.fail(rid, '{} is not a readable WAV file'.format(wavs[0]))
+            continue
+        entry = features.index.get(wavs[0])
+        if not (entry
+                and (entry['size'], entry['mtime'], entry['params']) ==
+                (info['size'], info['mtime'], PARAMS)
+                and all(features.path(wavs[0], name).exists() for name in FEATURES)):
+            todo[rid] = (wavs[0], info)
+        # Links to forms may change independently of the audio, e.g. when words are segmented:
+        if wavs[0] in features.index:
+            features.index[wavs[0]]['forms'] = form_frames(index, clips, rid)
+
+    jobs = {
+        rid: (store.dir / info['path'], info['wav'], features.dir / mid)
+        for rid, (mid, info) in todo.items()}
+    extracted = 0
+    try:
+        for rid, res in pool.map(extract, jobs):
+            extracted += 1
+            mid, info = todo[rid]
+            features.index[mid] = dict(
+                res,
+                recording=rid,
+                size=info['size'],
+                mtime=info['mtime'],
+                params=PARAMS,
+                forms=form_frames(index, clips, rid))
+    finally:
+        features.save()
+    args.log.info('{} recordings, features extracted for {}'.format(len(rids), extracted))
+    pool.check('Feature extraction', len(rids))
+
+
+def form_frames(index, clips, rid, hop=PARAMS['hop']):
+    """
+    :return: `list` of `[form ID, start frame, end frame]` triples for the forms linked to a \
+    recording - with `null` frames, if the words have not been located by `ucla.segment`.
+    """
+    offsets = clips.offsets(rid)
+    return [
+        [f['id']] + ([round(offsets[f['id']][0] / hop), round(offsets[f['id']][1] / hop)]
+                     if f['id'] in offsets else [None, None])
+        for f in index.forms(rid)]
+
+
+def to_float(samples, wav):
+    """
+    Convert samples to mono `float32` in the range [-1, 1].
+    """
+    res = samples.astype(numpy.float32)
+    if wav['format'] != 'float':
+        if wav['bits_per_sample'] == 8:
+            res -= 128
+        res /= 2 ** (min(wav['bits_per_sample'], 32) - 1)
+    return res.mean(axis=1)
+
+
+def frames(signal, start, count, width, hop):
+    """
+    Cut `count` frames of `width` samples every `hop` samples, starting at sample `start`, out of
+    `signal` - padding with zeros before the start and after the end of the signal.
+
+    :return: `numpy.ndarray` of shape (count, width).
+    """
+    stop = start + (count - 1) * hop + width
+    res = numpy.zeros(stop - start, dtype=numpy.float32)
+    lo, hi = max(start, 0), min(stop, len(signal))
+    if hi > lo:
+        res[lo - start:hi - start] = signal[lo:hi]
+    return numpy.lib.stride_tricks.sliding_window_view(res, width)[::hop][:count]
+
+
+def mel_filterbank(sample_rate, nfft, n):
+    """
+    :return: `numpy.ndarray` of shape (n, nfft // 2 + 1) with triangular filters, equally spaced \
+    on the mel scale.
+    """
+    mel = numpy.linspace(0, 2595 * numpy.log10(1 + sample_rate / 2 / 700), n + 2)
+    bins = numpy.fft.rfftfreq(nfft, 1 / sample_rate)
+    hz = 700 * (10 ** (mel / 2595) - 1)
+    lower, center, upper = hz[:-2, None], hz[1:-1, None], hz[2:, None]
+    return numpy.maximum(0, numpy.minimum(
+        (bins - lower) / (center - lower), (upper - bins) / (upper - center))).astype(numpy.float32)
+
+
+def dct_matrix(n, k):
+    """
+    :return: Matrix of the orthonormal DCT-II, computing the first `k` coefficients of `n` values.
+    """
+    res = numpy.cos(numpy.pi * numpy.arange(k)[:, None] * (2 * numpy.arange(n) + 1) / (2 * n))
+    res *= numpy.sqrt(2 / n)
+    res[0] /= numpy.sqrt(2)
+    return res.astype(numpy.float32)
+
+
+def pitch(frames_, sample_rate, f0_min, f0_max, threshold, octave_cost):
+    """
+    Estimate the fundamental frequency of frames from the peak of their normalized autocorrelation.
+
+    Periodic signals correlate at multiples of the period, too. To avoid octave errors, peaks at
+    longer lags are penalized by `octave_cost` per octave - like the "octave cost" of Praat.
+
+    :return: `numpy.ndarray` with f0 in Hz per frame - 0 for unvoiced frames.
+    """
+    width = frames_.shape[1]
+    window = numpy.hanning(width).astype(numpy.float32)
+    nfft = 1 << (2 * width - 1).bit_length()
+    # Autocorrelations via FFT, corrected for the autocorrelation of the window:
+    spectrum = numpy.fft.rfft((frames_ - frames_.mean(axis=1, keepdims=True)) * window, nfft)
+    ac = numpy.fft.irfft(spectrum.real ** 2 + spectrum.imag ** 2, nfft)[:, :width]
+    wac = numpy.fft.irfft(numpy.abs(numpy.fft.rfft(window, nfft)) ** 2, nfft)[:width]
+    ac = ac / numpy.maximum(ac[:, :1], 1e-10) / numpy.maximum(wac / wac[0], 1e-3)
+    lo, hi = int(sample_rate / f0_max), min(int(sample_rate / f0_min), width // 2)
+    lags = numpy.arange(lo, hi)
+    lag = lo + numpy.argmax(ac[:, lo:hi] - octave_cost * numpy.log2(lags / lo), axis=1)
+    rows = numpy.arange(len(lag))
+    strength = ac[rows, lag]
+    # Parabolic interpolation of the peak:
+    left, right = ac[rows, lag - 1], ac[rows, numpy.minimum(lag + 1, width - 1)]
+    denom = left - 2 * strength + right
+    shift = numpy.where(denom < 0, 0.5 * (left - right) / numpy.where(denom < 0, denom, -1), 0)
+    return numpy.where(strength > threshold, sample_rate / (lag + shift), 0).astype(numpy.float32)
+
+
+def extract(path, wav, target, chunk=2000, params=PARAMS):
+    """
+    Compute features for the audio in a WAV file, writing them to `.npy` files in `target`.
+
+    The audio is read from a memory map and processed in chunks of `chunk` frames, so memory use
+    does not depend on the length of the recording.
+
+    :return: `dict` with sample rate and number of frames.
+    """
+    sr = wav['sample_rate']
+    hop, width = int(sr * params['hop']), int(sr * params['window'])
+    pwidth = int(sr * params['pitch_window'])
+    nfft = 1 << (width - 1).bit_length()
+    data = numpy.memmap(str(path), dtype=numpy.uint8, mode='r')
+    samples = wav_samples(data[wav['data_offset']:wav['data_offset'] + wav['data_size']], wav)
+    n = max(0, (len(samples) - width) // hop + 1)
+
+    tmp = target.parent / '{}.tmp'.format(target.name)
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+    out = dict(
+        melspec=open_memmap(
+            str(tmp / 'melspec.npy'), mode='w+', dtype=numpy.float32, shape=(n, params['mels'])),
+        mfcc=open_memmap(
+            str(tmp / 'mfcc.npy'), mode='w+', dtype=numpy.float32, shape=(n, params['mfccs'])),
+        f0=open_memmap(str(tmp / 'f0.npy'), mode='w+', dtype=numpy.float32, shape=(n,)))
+    window = numpy.hanning(width).astype(numpy.float32)
+    mels = mel_filterbank(sr, nfft, params['mels'])
+    dct = dct_matrix(params['mels'], params['mfccs'])
+    # Pitch frames are centered on the spectral frames:
+    offset = (pwidth - width) // 2
+    for start in range(0, n, chunk):
+        count = min(chunk, n - start)
+        # Converting to float only the samples needed for this chunk:
+        lo = max(start * hop - offset, 0)
+        hi = min((start + count - 1) * hop + max(width, pwidth - offset), len(samples))
+        signal = to_float(samples[lo:hi], wav)
+        spec = numpy.abs(numpy.fft.rfft(
+            frames(signal, start * hop - lo, count, width, hop) * window, nfft)) ** 2
+        logmel = numpy.log(spec.astype(numpy.float32) @ mels.T + 1e-10)
+        out['melspec'][start:start + count] = logmel
+        out['mfcc'][start:start + count] = logmel @ dct.T
+        out['f0'][start:start + count] = pitch(
+            frames(signal, start * hop - offset - lo, count, pwidth, hop),
+            sr,
+            params['f0_min'],
+            params['f0_max'],
+            params['voicing_threshold'],
+            params['octave_cost'])
+    for array in out.values():
+        array.flush()
+    del out
+    if target.exists():
+        shutil.rmtree(target)
+    tmp.rename(target)
+    return dict(sample_rate=sr, frames=n)
+
+
+class Features:
+    """
+    Access to the acoustic features extracted from WAV files, by media ID or form ID.
+
+    Arrays are loaded as read-only memory maps of shape (frames, features) - or (frames,) for f0.
+    """
+    def __init__(self, ds):
+        self.dir = ds.cache_dir / 'features'
+        self.dir.mkdir(exist_ok=True)
+        self.index = load(self.dir / 'index.json') if self.dir.joinpath('index.json').exists() \
+            else {}
+        self._forms = None
+
+    def save(self):
+        dump(self.index, self.dir / 'index.json')
+        self._forms = None
+
+    def path(self, mid, name):
+        return self.dir / mid / '{}.npy'.format(name)
+
+    def load(self, mid, name):
+        """
+        :param name: One of "melspec", "mfcc" or "f0".
+        """
+        return numpy.load(str(self.path(mid, name)), mmap_mode='r')
+
+    def form(self, form_id, name):
+        """
+        :return: Features for the frames of a word, as located by `ucla.segment`.
+        """
+        if self._forms is None:
+            self._forms = {
+                fid: (mid, start, end)
+                for mid, entry in self.index.items()
+                for fid, start, end in entry['forms'] if start is not None}
+        mid, start, end = self._forms[form_id]
+        return self.load(mid, name)[start:end]
@@ -0,0 +1,281 @@
+"""
+(Re-)build the index used to look up media files and forms of recordings.
+
+The index is a SQLite database in raw/cache/, derived from the CLDF data. It is rebuilt
+automatically when the CLDF data is newer, so this command only needs to be run to force a
+rebuild.
+"""
+import json
+import sqlite3
+import collections
+import concurrent.futures
+
+from csvw.datatypes import anyURI
+from clldutils.clilib import ParserError
+
+from cldfbench_uclaphoneticslabarchive import Dataset
+
+SCHEMA = """
+CREATE TABLE recording (id TEXT PRIMARY KEY, language_id TEXT, position INTEGER);
+CREATE INDEX recording_language ON recording(language_id);
+CREATE TABLE media (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    media_type TEXT,
+    url TEXT,
+    size INTEGER,
+    length REAL);
+CREATE TABLE form (id TEXT PRIMARY KEY, parameter_id TEXT, original_data TEXT);
+CREATE INDEX form_parameter ON form(parameter_id);
+CREATE TABLE recording_media (recording_id TEXT, media_id TEXT, ord INTEGER);
+CREATE INDEX recording_media_recording ON recording_media(recording_id);
+CREATE TABLE recording_form (recording_id TEXT, form_id TEXT, ord INTEGER);
+CREATE INDEX recording_form_recording ON recording_form(recording_id);
+CREATE INDEX recording_form_form ON recording_form(form_id);
+CREATE TABLE recording_example (recording_id TEXT, example_id TEXT, ord INTEGER);
+CREATE INDEX recording_example_example ON recording_example(example_id);
+"""
+# Stored as `user_version` of the database, so an index with an outdated schema is rebuilt:
+VERSION = 2
+
+
+def register(parser):
+    pass
+
+
+def run(args):
+    index = Index(Dataset(), rebuild=True)
+    args.log.info('Indexed {} recordings in {}'.format(len(index.recording_ids()), index.path))
+
+
+def select(index, specs):
+    """
+    Resolve recording specifications given on the command line, see `Index.select`.
+
+    :raises ParserError: if a spec is neither a recording nor a language ID.
+    """
+    try:
+        return index.select(specs)
+    except ValueError as e:
+        raise ParserError(str(e))
+
+
+class Pool:
+    """
+    Process many items - e.g. recordings - in a pool of threads or processes, reporting all
+    failures rather than stopping at the first one.
+    """
+    def __init__(self, log, workers=None, processes=False):
+        self.log = log
+        self.workers = workers
+        self.processes = processes
+        self.failed = collections.OrderedDict()
+
+    def fail(self, key, error):
+        self.failed[key] = error
+        self.log.error('{}: {}'.format(key, error))
+
+    def map(self, func, jobs):
+        """
+        :param jobs: `dict` mapping keys - used to report failures - to tuples of arguments for \
+        `func`.
+        :return: Generator of `(key, result)` pairs for the successful calls, in the order of \
+        completion.
+        """
+        cls = concurrent.futures.ProcessPoolExecutor if self.processes \
+            else concurrent.futures.ThreadPoolExecutor
+        with cls(max_workers=self.workers) as executor:
+            futures = {executor.submit(func, *args): key for key, args in jobs.items()}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    res = future.result()
+                except Exception as e:  # We want to report all failures.
+                    self.fail(futures[future], e)
+                    continue
+                yield futures[future], res
+
+    def check(self, task, total):
+        """
+        :raises ValueError: if processing failed for any item.
+        """
+        if self.failed:
+            raise ValueError('{} failed for {} of {}: {}'.format(
+                task, len(self.failed), total, ' '.join(str(k) for k in sorted(self.failed))))
+
+
+class Index:
+    """
+    Lookup of the media files and forms linked to recordings, without reading the CLDF data.
+    """
+    def __init__(self, ds, rebuild=False):
+        self.ds = ds
+        self.path = ds.cache_dir / 'recordings.sqlite'
+        cldf_mtime = max(p.stat().st_mtime for p in ds.cldf_dir.iterdir())
+        if rebuild or (not self.path.exists()) or self.path.stat().st_mtime < cldf_mtime:
+            self.build()
+        self.db = sqlite3.connect(str(self.path))
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != VERSION:
+            self.db.close()
+            self.build()
+            self.db = sqlite3.connect(str(self.path))
+
+    def build(self):
+        cldf = self.ds.cldf_reader()
+        tmp = self.path.parent / '{}.tmp'.format(self.path.name)
+        if tmp.exists():
+            tmp.unlink()
+        db = sqlite3.connect(str(tmp))
+        with db:
+            db.executescript(SCHEMA)
+            db.execute('PRAGMA user_version = {}'.format(VERSION))
+            db.executemany(
+                'INSERT INTO media VALUES (?, ?, ?, ?, ?, ?)',
+                [(r['id'],
+                  r['name'],
+                  r['mediaType'],
+                  anyURI.to_string(r['downloadUrl']),
+                  r['size'],
+                  r['length'])
+                 for r in cldf.iter_rows(
+                    'MediaTable', 'id', 'name', 'mediaType', 'downloadUrl')])
+            db.executemany(
+                'INSERT INTO form VALUES (?, ?, ?)',
+                [(r['id'], r['parameterReference'], json.dumps(r['original_data']))
+                 for r in cldf.iter_rows('FormTable', 'id', 'parameterReference')])
+            for r in cldf.iter_rows(
+                    'ContributionTable',
+                    'id', 'languageReference', 'mediaReference', 'formReference',
+                    'exampleReference'):
+                db.execute(
+                    'INSERT INTO recording VALUES (?, ?, ?)',
+                    (r['id'], r['languageReference'], r['Position']))
+                db.executemany(
+                    'INSERT INTO recording_media VALUES (?, ?, ?)',
+                    [(r['id'], mid, i) for i, mid in enumerate(r['mediaReference'])])
+                db.executemany(
+                    'INSERT INTO recording_form VALUES (?, ?, ?)',
+                    [(r['id'], fid, i) for i, fid in enumerate(r['formReference'])])
+                db.executemany(
+                    'INSERT INTO recording_example VALUES (?, ?, ?)',
+                    [(r['id'], eid, i) for i, eid in enumerate(r['exampleReference'] or [])])
+        db.close()
+        tmp.replace(self.path)
+
+    def recording_ids(self, language_id=None, with_forms=False):
+        """
+        :param language_id: Only return recordings for this language.
+        :param with_forms: Only return recordings linked to forms, i.e. recordings of word lists.
+        """
+        sql, where, params = 'SELECT id FROM recording', [], []
+        if language_id:
+            where.append('language_id = ?')
+            params.append(language_id)
+        if with_forms:
+            where.append('id IN (SELECT recording_id FROM recording_form)')
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        return [row[0] for row in self.db.execute(sql + ' ORDER BY language_id, position', params)]
+
+    def select(self, specs):
+        """
+        Resolve recording specifications.
+
+        :param specs: Recording IDs, language IDs - selecting all recordings of word lists for \
+        the language - or "all", selecting all recordings of word lists.
+        :return: `list` of recording IDs.
+        :raises ValueError: if a spec is neither a recording nor a language ID.
+        """
+        rids, languages, recordings = [], set(self.language_ids()), set(self.recording_ids())
+        for spec in specs:
+            if spec == 'all':
+                rids.extend(self.recording_ids(with_forms=True))
+            elif spec in languages:
+                rids.extend(self.recording_ids(language_id=spec, with_forms=True))
+            elif spec in recordings:
+                rids.append(spec)
+            else:
+                raise ValueError('Unknown recording or language {}'.format(spec))
+        return list(dict.fromkeys(rids))
+
+    def language_ids(self):
+        return [row[0] for row in self.db.execute(
+            'SELECT DISTINCT language_id FROM recording ORDER BY language_id')]
+
+    def form_recordings(self, form_id):
+        """
+        :return: `list` of IDs of the recordings linked to a form.
+        """
+        return [row[0] for row in self.db.execute(
+            'SELECT recording_id FROM recording_form WHERE form_id = ? ORDER BY recording_id',
+            (form_id,))]
+
+    @staticmethod
+    def _links(id_, parameter):
+        """
+        :return: `(sql, params)` pair - a query for `(id, recording_id)` rows, linking forms or \
+        examples to recordings.
+        """
+        if bool(id_) == bool(parameter):
+            raise ValueError('Either an ID or a parameter must be specified')
+        if parameter:
+            return """SELECT rf.form_id AS id, rf.recording_id AS recording_id
+FROM recording_form AS rf JOIN form AS f ON f.id = rf.form_id WHERE f.parameter_id = ?""", \
+                [parameter]
+        return """SELECT form_id AS id, recording_id FROM recording_form WHERE form_id = ?
+UNION SELECT example_id, recording_id FROM recording_example WHERE example_id = ?""", [id_, id_]
+
+    def recordings(self, id_=None, parameter=None):
+        """
+        :param id_: ID of a form or example.
+        :param parameter: ID of a parameter, i.e. look up the recordings of all forms for it.
+        :return: `list` of `(form or example ID, recording ID)` pairs.
+        """
+        sql, params = self._links(id_, parameter)
+        return self.db.execute(
+            'SELECT id, recording_id FROM ({}) ORDER BY id, recording_id'.format(sql),
+            params).fetchall()
+
+    def find_media(self, id_=None, parameter=None, media_type=None):
+        """
+        :param id_: ID of a form or example.
+        :param parameter: ID of a parameter, i.e. look up the media of all forms for it.
+        :param media_type: Only return media files of this type, e.g. "audio/x-wav".
+        :return: `list` of `(form or example ID, recording ID, media ID)` triples.
+        """
+        sql, params = self._links(id_, parameter)
+        where = ''
+        if media_type:
+            where = ' WHERE m.media_type = ?'
+            params.append(media_type)
+        return self.db.execute(
+            """SELECT r.id, r.recording_id, rm.media_id
+FROM ({}) AS r
+JOIN recording_media AS rm ON rm.recording_id = r.recording_id
+JOIN media AS m ON m.id = rm.media_id{} ORDER BY r.id, r.recording_id, rm.ord""".format(
+                sql, where),
+            params).fetchall()
+
+    def media(self, recording_id):
+        """
+        :return: `list` of `dict`s describing the media files linked to a recording.
+        """
+        return [
+            dict(zip(['id', 'name', 'media_type', 'url', 'size', 'length'], row))
+            for row in self.db.execute(
+                """SELECT m.id, m.name, m.media_type, m.url, m.size, m.length
+FROM media AS m JOIN recording_media AS rm ON m.id = rm.media_id
+WHERE rm.recording_id = ? ORDER BY rm.ord""",
+                (recording_id,))]
+
+    def forms(self, recording_id):
+        """
+        :return: `list` of `dict`s with keys `id` and `original_data` for the forms linked to a \
+        recording.
+        """
+        return [
+            dict(id=row[0], original_data=json.loads(row[1]))
+            for row in self.db.execute(
+                """SELECT f.id, f.original_data
+FROM form AS f JOIN recording_form AS rf ON f.id = rf.form_id
+WHERE rf.recording_id = ? ORDER BY rf.ord""",
+                (recording_id,))]
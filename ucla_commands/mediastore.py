@@ -0,0 +1,236 @@
+"""
+(Re-)build the index of the media files downloaded to raw/media/.
+
+The index records the location of audio data in WAV files and of image data in TIF files, so that
+parts of these files can be read via memory maps, without parsing headers or loading whole files.
+It is updated automatically when files are added or changed, so this command only needs to be run
+to force a rebuild.
+"""
+import os
+import struct
+import threading
+import collections
+
+import numpy
+from clldutils.jsonlib import dump, load
+
+from cldfbench_uclaphoneticslabarchive import Dataset
+from .probe import LocalFile, wav_info
+
+# TIFF tags we need to locate the image data, see https://www.itu.int/itudoc/itu-t/com16/tiff-fx/docs/tiff6.pdf
+TIFF_TAGS = {
+    256: 'width',
+    257: 'height',
+    258: 'bits_per_sample',
+    259: 'compression',
+    273: 'strip_offsets',
+    277: 'samples_per_pixel',
+    279: 'strip_byte_counts',
+    284: 'planar_configuration',
+}
+TIFF_TYPES = {3: 'H', 4: 'I'}  # SHORT and LONG
+
+
+def register(parser):
+    pass
+
+
+def run(args):
+    store = MediaStore(Dataset(), rebuild=True)
+    args.log.info('Indexed {} media files in {}'.format(len(store.index), store.path))
+
+
+def tiff_info(f):
+    """
+    Read dimensions and - for uncompressed images stored in contiguous strips - the location of the
+    image data from the first image file directory of a TIFF file.
+    """
+    head = f.read(0, 8)
+    if head[:4] not in {b'II*\x00', b'MM\x00*'}:
+        raise ValueError('Not a TIFF file')
+    bo = '<' if head[:2] == b'II' else '>'
+    pos = struct.unpack(bo + 'I', head[4:])[0]
+    n = struct.unpack(bo + 'H', f.read(pos, 2))[0]
+    entries = f.read(pos + 2, 12 * n)
+    tags = {}
+    for i in range(n):
+        tag, type_, count = struct.unpack(bo + 'HHI', entries[i * 12:i * 12 + 8])
+        if tag in TIFF_TAGS and type_ in TIFF_TYPES:
+            fmt = '{}{}{}'.format(bo, count, TIFF_TYPES[type_])
+            size = struct.calcsize(fmt)
+            # Values which fit into 4 bytes are stored inline, otherwise we get an offset:
+            data = entries[i * 12 + 8:i * 12 + 8 + size] if size <= 4 else \
+                f.read(struct.unpack(bo + 'I', entries[i * 12 + 8:i * 12 + 12])[0], size)
+            tags[TIFF_TAGS[tag]] = list(struct.unpack(fmt, data))
+    res = dict(
+        width=tags['width'][0],
+        height=tags['height'][0],
+        samples_per_pixel=tags.get('samples_per_pixel', [1])[0],
+        bits_per_sample=tags.get('bits_per_sample', [1])[0],
+        # 1 for samples of a pixel stored together ("chunky"), 2 for one plane per sample:
+        planar_configuration=tags.get('planar_configuration', [1])[0],
+        byte_order=bo,
+    )
+    offsets, counts = tags.get('strip_offsets', []), tags.get('strip_byte_counts', [])
+    if tags.get('compression', [1])[0] == 1 and offsets and len(offsets) == len(counts) \
+            and all(o + c == no for o, c, no in zip(offsets, counts, offsets[1:])):
+        res.update(data_offset=offsets[0], data_size=sum(counts))
+    return res
+
+
+def wav_samples(data, wav):
+    """
+    Interpret bytes of the data chunk of a WAV file as samples.
+
+    :param data: `numpy.ndarray` of `uint8`, starting at a frame boundary.
+    :param wav: WAV header info as returned by `wav_info`.
+    :return: `numpy.ndarray` of shape (frames, channels) - a view of `data`, except for 24 bit \
+    audio, which is converted to `int32`.
+    """
+    width, channels = wav['bits_per_sample'] // 8, wav['channels']
+    data = data[:len(data) // (width * channels) * width * channels]
+    if width == 3:
+        data = data.reshape(-1, 3)
+        return (numpy.pad(data, ((0, 0), (1, 0))).view('<i4')[:, 0] >> 8).reshape(-1, channels)
+    dtype = {1: 'u1', 2: '<i2', 4: '<f4' if wav['format'] == 'float' else '<i4', 8: '<f8'}
+    return data.view(dtype[width]).reshape(-1, channels)
+
+
+class MediaStore:
+    """
+    Read access to the media files in raw/media/ by media ID - i.e. `MediaTable.ID`, such as
+    `ema_word-list_1962_01_wav`.
+
+    Reads return `numpy.memmap` objects, i.e. only the parts of a file which are actually accessed
+    are read from disk.
+    """
+    def __init__(self, ds, rebuild=False, max_open=64):
+        self.dir = ds.raw_dir / 'media'
+        self.path = ds.cache_dir / 'mediastore.json'
+        self.index = {} if rebuild or not self.path.exists() else load(self.path)
+        self.max_open = max_open
+        self._maps = collections.OrderedDict()
+        # The store may be shared by threads, e.g. of `ucla.serve`. Re-entrant, because `_map`
+        # may trigger a `refresh`:
+        self._lock = threading.RLock()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Add new and changed files to the index, and remove deleted files.
+        """
+        with self._lock:
+            changed, seen = False, set()
+            for d in (os.scandir(str(self.dir)) if self.dir.exists() else []):
+                if not d.is_dir():
+                    continue
+                for e in os.scandir(d.path):
+                    if not e.is_file() or e.name.endswith('.part'):
+                        continue
+                    mid = e.name.replace('.', '_')
+                    seen.add(mid)
+                    stat = e.stat()
+                    info = self.index.get(mid)
+                    # TIF info recorded before the planar configuration was read must be updated:
+                    if info and info['size'] == stat.st_size and info['mtime'] == stat.st_mtime \
+                            and ('tif' not in info or 'planar_configuration' in info['tif']):
+                        continue
+                    self.index[mid] = self._info(
+                        '{}/{}'.format(d.name, e.name), stat.st_size, stat.st_mtime)
+                    self._maps.pop(mid, None)
+                    changed = True
+            for mid in set(self.index) - seen:
+                del self.index[mid]
+                changed = True
+            if changed or not self.path.exists():
+                dump(self.index, self.path)
+
+    def _info(self, path, size, mtime):
+        res = dict(path=path, size=size, mtime=mtime)
+        suffix = path.split('.')[-1].lower()
+        try:
+            if suffix == 'wav':
+                res['wav'] = wav_info(LocalFile(self.dir / path))
+            elif suffix in {'tif', 'tiff'}:
+                res['tif'] = tiff_info(LocalFile(self.dir / path))
+        except (ValueError, struct.error):  # Files with broken headers are still readable as bytes.
+            pass
+        return res
+
+    def __contains__(self, mid):
+        return mid in self.index
+
+    def info(self, mid):
+        """
+        :return: `dict` with path (relative to raw/media/), size and mtime of the file, and - for \
+        WAV and TIF files - header data.
+        """
+        if mid not in self.index:
+            self.refresh()
+        if mid not in self.index:
+            raise KeyError('Media file {} has not been downloaded'.format(mid))
+        return self.index[mid]
+
+    def _map(self, mid):
+        with self._lock:
+            if mid in self._maps:
+                self._maps.move_to_end(mid)
+            else:
+                info = self.info(mid)
+                self._maps[mid] = numpy.memmap(
+                    str(self.dir / info['path']), dtype=numpy.uint8, mode='r') if info['size'] \
+                    else numpy.zeros(0, dtype=numpy.uint8)
+                # Arrays returned earlier keep their memory map alive, so we can simply drop it.
+                if len(self._maps) > self.max_open:
+                    self._maps.popitem(last=False)
+            return self._maps[mid]
+
+    def bytes(self, mid, start=0, stop=None):
+        """
+        :return: Read-only `numpy.memmap` of `uint8` for the byte range `start:stop` of a file.
+        """
+        return self._map(mid)[start:stop]
+
+    def samples(self, mid, start=0, stop=None):
+        """
+        Access the samples of a WAV file.
+
+        :param start: First frame.
+        :param stop: End frame (exclusive).
+        :return: `numpy.ndarray` of shape (frames, channels) - a view of the memory map, except \
+        for 24 bit audio, which is converted to `int32`.
+        """
+        wav = self.info(mid).get('wav')
+        if not wav:
+            raise ValueError('{} is not a readable WAV file'.format(mid))
+        width, channels = wav['bits_per_sample'] // 8, wav['channels']
+        frames = wav['data_size'] // (width * channels)
+        start, stop, _ = slice(start, stop).indices(frames)
+        stop = max(start, stop)
+        return wav_samples(self.bytes(
+            mid,
+            wav['data_offset'] + start * width * channels,
+            wav['data_offset'] + stop * width * channels), wav)
+
+    def seconds(self, mid, start, end):
+        """
+        Access the samples of a WAV file between `start` and `end` seconds.
+        """
+        sr = self.info(mid)['wav']['sample_rate']
+        return self.samples(mid, int(start * sr), int(end * sr))
+
+    def image(self, mid):
+        """
+        :return: `numpy.ndarray` of shape (height, width, samples per pixel), viewing the memory \
+        map of an uncompressed 8 or 16 bit TIF file.
+        """
+        tif = self.info(mid).get('tif')
+        if not (tif and 'data_offset' in tif and tif['bits_per_sample'] in {8, 16}):
+            raise ValueError('{} is not an uncompressed 8 or 16 bit TIF file'.format(mid))
+        data = self.bytes(mid, tif['data_offset'], tif['data_offset'] + tif['data_size'])
+        data = data.view(tif['byte_order'] + ('u1' if tif['bits_per_sample'] == 8 else 'u2'))
+        if tif['planar_configuration'] == 2:
+            # The planes of the samples are stored one after the other:
+            return data.reshape(tif['samples_per_pixel'], tif['height'], tif['width'])\
+                .transpose(1, 2, 0)
+        return data.reshape(tif['height'], tif['width'], tif['samples_per_pixel'])
@@ -0,0 +1,220 @@
+"""
+Package the media files downloaded to raw/media/ into one zip archive per language directory.
+
+Members are stored uncompressed - audio and images hardly compress anyway - so they can be read
+directly from the archive, without extraction. Besides the archives, a file media.csv is written
+to the output directory: a copy of the MediaTable for the packaged files, with `Download_URL`
+pointing to the archive and `Path_In_Zip` to the member.
+"""
+import os
+import csv
+import time
+import struct
+import pathlib
+import zipfile
+import threading
+import collections
+import urllib.parse
+
+import numpy
+
+from cldfbench_uclaphoneticslabarchive import Dataset
+from .mediastore import MediaStore
+
+
+def register(parser):
+    parser.add_argument(
+        'language',
+        nargs='*',
+        help='Language directory names, e.g. "BFQ". If no language is specified, the media of all '
+             'languages are packaged.')
+    parser.add_argument(
+        '--output',
+        type=pathlib.Path,
+        default=pathlib.Path('raw') / 'zips',
+        help='Directory to write the zip archives and media.csv to.')
+    parser.add_argument(
+        '--base-url',
+        default=None,
+        help='URL under which the zip archives will be published. If not specified, the '
+             '`Download_URL` in media.csv is the filename of the archive.')
+
+
+def run(args):
+    ds = Dataset()
+    store = MediaStore(ds)
+    files = collections.defaultdict(dict)
+    for mid, info in store.index.items():
+        dname, fname = info['path'].split('/')
+        files[dname][fname] = info
+    if not args.output.exists():
+        args.output.mkdir(parents=True)
+
+    for dname in sorted(args.language or files):
+        if dname not in files:
+            args.log.warning('No media downloaded for {}'.format(dname))
+            continue
+        written = package(store.dir / dname, files[dname], args.output / '{}.zip'.format(dname))
+        if written:
+            args.log.info('{}: {} files written to the archive'.format(dname, written))
+
+    n = write_media_table(ds, args.output, args.base_url)
+    args.log.info('{} media files packaged in {}'.format(n, args.output))
+
+
+def zip_time(mtime):
+    """
+    :return: The modification time as stored in a zip archive, i.e. with 2 second resolution.
+    """
+    res = time.localtime(mtime)[:6]
+    return res[:5] + (res[5] // 2 * 2,)
+
+
+def package(d, files, target):
+    """
+    Add the files in `d` to a zip archive, appending new files to an existing archive. If files were
+    changed or removed, the archive is re-created.
+
+    :param files: `dict` mapping filenames to `dict`s with `size` and `mtime`.
+    :return: Number of files written to the archive.
+    """
+    members = {}
+    if target.exists():
+        try:
+            with zipfile.ZipFile(str(target)) as zf:
+                members = {i.filename: i for i in zf.infolist()}
+        except zipfile.BadZipFile:  # Truncated by an interrupted run.
+            target.unlink()
+
+    def unchanged(fname):
+        info = members[member(d, fname)]
+        return info.file_size == files[fname]['size'] \
+            and info.date_time == zip_time(files[fname]['mtime']) \
+            and info.compress_type == zipfile.ZIP_STORED
+
+    names = {member(d, fname): fname for fname in files}
+    if set(members) - set(names) or not all(unchanged(names[m]) for m in members):
+        # Members cannot be replaced or removed in place.
+        tmp = target.parent / '{}.tmp'.format(target.name)
+        with zipfile.ZipFile(str(tmp), 'w', compression=zipfile.ZIP_STORED) as zf:
+            for fname in sorted(files):
+                # ZipFile.write streams the file in chunks, i.e. doesn't read it into memory.
+                zf.write(str(d / fname), member(d, fname))
+        os.replace(tmp, target)
+        return len(files)
+
+    todo = sorted(fname for fname in files if member(d, fname) not in members)
+    if todo:
+        with zipfile.ZipFile(str(target), 'a', compression=zipfile.ZIP_STORED) as zf:
+            for fname in todo:
+                zf.write(str(d / fname), member(d, fname))
+    return len(todo)
+
+
+def member(d, fname):
+    # We keep the directory in the member name, so extracting the archive recreates raw/media/.
+    return '{}/{}'.format(d.name, fname)
+
+
+def write_media_table(ds, d, base_url=None):
+    """
+    Write a copy of the MediaTable, restricted to the files packaged in `d`.
+
+    The MediaTable of the dataset keeps `Path_In_Zip` empty: There, `Download_URL` points to the
+    individual files on the Archive's server, and `Path_In_Zip` would - according to the CLDF
+    spec - mean that this URL points to a zip archive.
+
+    :return: Number of packaged files.
+    """
+    packaged = {}
+    for p in sorted(d.glob('*.zip')):
+        with zipfile.ZipFile(str(p)) as zf:
+            for name in zf.namelist():
+                packaged[name.split('/')[-1].replace('.', '_')] = (p.name, name)
+
+    table = ds.cldf_reader()['MediaTable']
+    n = 0
+    with table.url.resolve(ds.cldf_dir).open(encoding='utf8', newline='') as fin, \
+            d.joinpath('media.csv').open('w', encoding='utf8', newline='') as fout:
+        reader = csv.DictReader(fin)
+        writer = csv.DictWriter(fout, reader.fieldnames)
+        writer.writeheader()
+        for row in reader:
+            if row['ID'] in packaged:
+                zname, row['Path_In_Zip'] = packaged[row['ID']]
+                row['Download_URL'] = urllib.parse.urljoin(base_url, zname) if base_url else zname
+                writer.writerow(row)
+                n += 1
+    return n
+
+
+class MediaZips:
+    """
+    Read access to the media files packaged by `ucla.packagemedia`, by media ID.
+
+    Since members are stored uncompressed, their content can be accessed via a memory map of the
+    archive - i.e. reading a part of a member only reads this part from disk.
+    """
+    def __init__(self, d, max_open=64):
+        self.dir = d
+        self.index = {}
+        with d.joinpath('media.csv').open(encoding='utf8', newline='') as f:
+            for row in csv.DictReader(f):
+                self.index[row['ID']] = (row['Download_URL'].split('/')[-1], row['Path_In_Zip'])
+        self.max_open = max_open
+        self._zips = collections.OrderedDict()
+        self._lock = threading.Lock()  # Archives may be read from several threads.
+
+    def __contains__(self, mid):
+        return mid in self.index
+
+    def _zip(self, zname):
+        with self._lock:
+            if zname in self._zips:
+                self._zips.move_to_end(zname)
+            else:
+                p = self.dir / zname
+                members = {}
+                with zipfile.ZipFile(str(p)) as zf, p.open('rb') as f:
+                    for info in zf.infolist():
+                        # The data follows the local file header - whose extra field may differ from
+                        # the one in the central directory.
+                        f.seek(info.header_offset)
+                        header = f.read(30)
+                        n, m = struct.unpack('<HH', header[26:30])
+                        members[info.filename] = (
+                            info.header_offset + 30 + n + m, info.file_size, info.compress_type)
+                self._zips[zname] = (
+                    numpy.memmap(str(p), dtype=numpy.uint8, mode='r') if p.stat().st_size else None,
+                    members)
+                if len(self._zips) > self.max_open:
+                    self._zips.popitem(last=False)
+            return self._zips[zname]
+
+    def open(self, mid):
+        """
+        :return: File-like object for the content of a media file - to be closed by the caller, \
+        e.g. using it as context manager.
+        """
+        zname, name = self.index[mid]
+        # The archive file is closed when the returned member file is closed:
+        with zipfile.ZipFile(str(self.dir / zname)) as zf:
+            return zf.open(name)
+
+    def bytes(self, mid, start=0, stop=None):
+        """
+        :return: Read-only `numpy.memmap` of `uint8` for the byte range `start:stop` of a file.
+        """
+        zname, name = self.index[mid]
+        data, members = self._zip(zname)
+        offset, size, compress_type = members[name]
+        if compress_type != zipfile.ZIP_STORED:
+            raise ValueError('{} is compressed in {}'.format(mid, zname))
+        start, stop, _ = slice(start, stop).indices(size)
+        return data[offset + start:offset + max(start, stop)]
+
+    def read(self, mid):
+        """
+        :return: The content of a media file as `bytes`.
+        """
+        return self.bytes(mid).tobytes()
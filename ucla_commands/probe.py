@@ -0,0 +1,295 @@
+"""
+Fill in missing sizes and durations of media files in etc/urls.json.
+
+Rather than downloading the media files, sizes are retrieved via HEAD requests and the duration
+of audio files is computed from the RIFF or MP3 headers, read via HTTP Range requests. Results
+are cached in raw/cache/probe.jsonl, so an interrupted run can simply be restarted.
+"""
+import json
+import struct
+import urllib.error
+import http.client
+
+from clldutils.jsonlib import load, dump
+
+from cldfbench_uclaphoneticslabarchive import Dataset, Fetcher
+
+AUDIO = {'wav', 'mp3'}
+
+# MPEG audio frame header fields, see http://www.mp3-tech.org/programmer/frame_header.html
+MPEG_VERSIONS = {0: 2.5, 2: 2, 3: 1}
+MPEG_LAYERS = {1: 3, 2: 2, 3: 1}
+MPEG_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+MPEG_BITRATES = {  # kbit/s, indexed by bitrate index 1..14
+    (1, 1): [32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+
+def register(parser):
+    parser.add_argument('--suffix', choices='mp3 jpg wav tif'.split())
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=8,
+        help="Number of files to probe in parallel")
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        default=False,
+        help="Ignore cached results and probe all files with missing size or length again")
+
+
+def run(args):
+    ds = Dataset()
+    urls = load(ds.etc_dir / 'urls.json')
+    cache = ProbeCache(ds.cache_dir / 'probe.jsonl')
+    fetcher = Fetcher(workers=args.workers)
+
+    todo = []
+    for key, (url, size, length) in urls.items():
+        suffix = key.split('.')[-1].lower()
+        if url and (not args.suffix or suffix == args.suffix) \
+                and (size is None or (length is None and suffix in AUDIO)):
+            todo.append((key, url))
+
+    def probe_one(item):
+        key, url = item
+        if url in cache and not args.refresh:
+            return key, url, cache[url], True
+        local = ds.raw_dir / 'media' / key
+        try:
+            return key, url, probe(
+                fetcher,
+                url,
+                key.split('.')[-1].lower(),
+                LocalFile(local) if local.exists() else RemoteFile(fetcher, url)), False
+        except (ValueError, OSError, http.client.HTTPException, urllib.error.URLError) as e:
+            args.log.warning('{}: {}'.format(url, e))
+            return key, url, None, False
+
+    updated, cached = 0, 0
+    try:
+        for key, url, info, from_cache in fetcher.map(probe_one, todo):
+            if info is None:
+                continue
+            if from_cache:
+                cached += 1
+            else:
+                cache[url] = info
+            _, size, length = urls[key]
+            if size is None and info.get('size') is not None:
+                urls[key][1] = info['size']
+            if length is None and info.get('length') is not None:
+                urls[key][2] = info['length']
+            if urls[key][1:] != [size, length]:
+                updated += 1
+    finally:
+        cache.close()
+        dump(urls, ds.etc_dir / 'urls.json', indent=2)
+    args.log.info('Probed {} files ({} from cache), updated {} entries in etc/urls.json'.format(
+        len(todo), cached, updated))
+
+
+class ProbeCache(dict):
+    """
+    Probe results keyed by URL, persisted as JSON lines - so results are kept even if a run is
+    interrupted.
+    """
+    def __init__(self, path):
+        dict.__init__(self)
+        self.path = path
+        if path.exists():
+            with path.open(encoding='utf8') as f:
+                for line in f:
+                    if line.strip():
+                        try:
+                            item = json.loads(line)
+                        except ValueError:  # A line truncated when a previous run was killed.
+                            continue
+                        dict.__setitem__(self, item.pop('url'), item)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._fp = path.open('a', encoding='utf8')
+
+    def __setitem__(self, url, info):
+        dict.__setitem__(self, url, info)
+        self._fp.write(json.dumps(dict(url=url, **info)) + '\n')
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+
+class RemoteFile:
+    """
+    Read access to parts of a remote file, fetching only the blocks which are needed via Range
+    requests.
+    """
+    def __init__(self, fetcher, url, block_size=8192):
+        self.fetcher = fetcher
+        self.url = url
+        self.block_size = block_size
+        self.size = None
+        self._blocks = {}
+
+    def read(self, offset, n):
+        first, last = offset // self.block_size, (offset + n - 1) // self.block_size
+        data = b''
+        for i in range(first, last + 1):
+            if i not in self._blocks:
+                self._blocks[i], size = self.fetcher.read_range(
+                    self.url, i * self.block_size, (i + 1) * self.block_size - 1)
+                self.size = self.size or size
+            data += self._blocks[i]
+        start = offset - first * self.block_size
+        return data[start:start + n]
+
+
+class LocalFile:
+    """
+    Read access to parts of an already downloaded media file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.size = path.stat().st_size
+
+    def read(self, offset, n):
+        with self.path.open('rb') as f:
+            f.seek(offset)
+            return f.read(n)
+
+
+def probe(fetcher, url, suffix, f):
+    """
+    :return: `dict` with the size of the file and - for audio files - duration in seconds and \
+    audio format info.
+    """
+    if suffix == 'wav':
+        info = wav_info(f)
+    elif suffix == 'mp3':
+        info = mp3_info(f)
+    else:
+        info = {}
+    info['size'] = f.size
+    if info['size'] is None:
+        res = fetcher.retry(fetcher.request, url, None, 'HEAD')
+        res.read()
+        size = res.getheader('Content-Length')
+        info['size'] = int(size) if size else None
+    return info
+
+
+def wav_info(f):
+    """
+    Read duration and format of a WAV file - and the location of the audio data in the file -
+    from the RIFF chunk headers.
+    """
+    head = f.read(0, 12)
+    if head[:4] != b'RIFF' or head[8:12] != b'WAVE':
+        raise ValueError('Not a RIFF WAVE file')
+    pos, fmt = 12, None
+    while True:
+        header = f.read(pos, 8)
+        if len(header) < 8:
+            raise ValueError('No data chunk found')
+        cid, csize = header[:4], struct.unpack('<I', header[4:])[0]
+        if cid == b'fmt ':
+            tag, channels, sample_rate, byte_rate, _, bits = struct.unpack(
+                '<HHIIHH', f.read(pos + 8, 16))
+            if tag == 0xFFFE:  # WAVE_FORMAT_EXTENSIBLE: The format is given as sub-format.
+                tag = struct.unpack('<H', f.read(pos + 32, 2))[0]
+            fmt = dict(
+                channels=channels,
+                sample_rate=sample_rate,
+                bits_per_sample=bits,
+                format='float' if tag == 3 else 'pcm')
+        elif cid == b'data':
+            if not fmt or not byte_rate:
+                raise ValueError('No format chunk found')
+            if f.size and (pos + 8 + csize > f.size):
+                # Truncated file or bogus chunk size, e.g. 0xFFFFFFFF written by streaming tools.
+                csize = f.size - pos - 8
+            fmt.update(
+                data_offset=pos + 8, data_size=csize, length=round(csize / byte_rate, 3))
+            return fmt
+        pos += 8 + csize + csize % 2
+
+
+def mpeg_frame(header):
+    """
+    Parse an MPEG audio frame header.
+
+    :return: `dict` or `None`, if `header` isn't a valid frame header.
+    """
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = MPEG_VERSIONS.get((header[1] >> 3) & 3)
+    layer = MPEG_LAYERS.get((header[1] >> 1) & 3)
+    bitrate_index, sample_rate_index = header[2] >> 4, (header[2] >> 2) & 3
+    if not (version and layer) or bitrate_index in {0, 15} or sample_rate_index == 3:
+        return None
+    bitrate = MPEG_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index - 1] * 1000
+    sample_rate = MPEG_SAMPLE_RATES[version][sample_rate_index]
+    padding = (header[2] >> 1) & 1
+    if layer == 1:
+        samples, frame_length = 384, (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if (layer == 2 or version == 1) else 576
+        frame_length = samples // 8 * bitrate // sample_rate + padding
+    return dict(
+        version=version,
+        layer=layer,
+        bitrate=bitrate,
+        sample_rate=sample_rate,
+        channels=1 if header[3] >> 6 == 3 else 2,
+        samples=samples,
+        frame_length=frame_length)
+
+
+def mp3_info(f):
+    """
+    Read duration and format of an MP3 file from the first frame header - and the Xing/Info or
+    VBRI header for files with variable bitrate.
+    """
+    pos, head = 0, f.read(0, 10)
+    if head[:3] == b'ID3':  # Skip the ID3v2 tag.
+        pos = 10 + sum((b & 0x7F) << (7 * (3 - i)) for i, b in enumerate(head[6:10]))
+        if head[5] & 0x10:  # Footer present.
+            pos += 10
+    buf = f.read(pos, 16384)
+    for i in range(len(buf) - 4):
+        frame = mpeg_frame(buf[i:i + 4])
+        # We require a second frame header following the first to rule out false syncs.
+        if frame and mpeg_frame(f.read(pos + i + frame['frame_length'], 4)):
+            break
+    else:
+        raise ValueError('No MPEG audio frame found')
+    start = pos + i
+    frame_data = f.read(start, frame['frame_length'])
+
+    frames = None
+    if frame['version'] == 1:
+        side_info = 17 if frame['channels'] == 1 else 32
+    else:
+        side_info = 9 if frame['channels'] == 1 else 17
+    xing = frame_data[4 + side_info:4 + side_info + 12]
+    if xing[:4] in {b'Xing', b'Info'} and struct.unpack('>I', xing[4:8])[0] & 1:
+        frames = struct.unpack('>I', xing[8:12])[0]
+    elif frame_data[36:40] == b'VBRI':
+        frames = struct.unpack('>I', frame_data[50:54])[0]
+
+    if frames:
+        length = frames * frame['samples'] / frame['sample_rate']
+    elif f.size:
+        length = (f.size - start) * 8 / frame['bitrate']
+    else:
+        raise ValueError('Cannot determine length of CBR file of unknown size')
+    return dict(
+        channels=frame['channels'],
+        sample_rate=frame['sample_rate'],
+        bitrate=frame['bitrate'],
+        length=round(length, 3))
@@ -0,0 +1,196 @@
+"""
+Detect the words in the audio of word list recordings.
+
+Word boundaries are detected from the energy of the audio signal: Stretches above a threshold
+between the noise floor and the peak level are taken as words, and are then merged across the
+shortest pauses (or split at the quietest point) to match the number of forms linked to the
+recording. The offsets are stored in raw/clips/<LANGUAGE>.json, and added to the CLDF data as
+clips.csv by `cldfbench makecldf`.
+"""
+import numpy
+import soundfile
+from clldutils.jsonlib import dump, load
+
+from cldfbench_uclaphoneticslabarchive import Dataset
+from .downloadmedia import download
+from .index import Index, Pool, select
+from .mediastore import MediaStore
+
+
+def register(parser):
+    parser.add_argument(
+        'recording',
+        nargs='+',
+        help='Recording ID, language ID or "all".')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Number of recordings to process in parallel.')
+
+
+def run(args):
+    ds = Dataset()
+    index = Index(ds)
+    rids = select(index, args.recording)
+    forms = {rid: [f['id'] for f in index.forms(rid)] for rid in rids}
+
+    def detect(rid):
+        if not forms[rid]:
+            raise ValueError('No forms linked to recording {}'.format(rid))
+        wav = download(ds, recording=rid, suffix='wav', workers=1)
+        if not wav:
+            raise ValueError('No WAV file for recording {}'.format(rid))
+        offsets, exact = segment(wav, len(forms[rid]))
+        return dict(
+            media=wav.name,
+            exact=exact,
+            forms=[[fid, start, end] for fid, (start, end) in zip(forms[rid], offsets)])
+
+    clips, pool = Clips(ds), Pool(args.log, workers=args.workers)
+    for rid, res in pool.map(detect, {rid: (rid,) for rid in rids}):
+        clips[rid] = res
+        args.log.info('{}: {} words{}'.format(
+            rid, len(forms[rid]), '' if res['exact'] else ' (fitted)'))
+    clips.save()
+    pool.check('Word detection', len(rids))
+
+
+def frame_energy(path, hop=0.01):
+    """
+    Compute the energy of the audio signal in dB for consecutive frames of `hop` seconds.
+
+    The file is read in blocks, so memory use does not depend on the length of the recording.
+    """
+    res = []
+    with soundfile.SoundFile(str(path)) as f:
+        n = max(int(f.samplerate * hop), 1)
+        for block in f.blocks(blocksize=n * 1000, dtype='float32', always_2d=True):
+            mono = block.mean(axis=1)
+            frames = len(mono) // n
+            if frames:
+                res.append(numpy.sqrt(numpy.mean(
+                    numpy.square(mono[:frames * n].reshape(frames, n)), axis=1)))
+    return 20 * numpy.log10(numpy.concatenate(res) + 1e-10) if res else numpy.zeros(0)
+
+
+def detect_words(db, hop=0.01, ratio=0.3, min_pause=0.25, min_length=0.1):
+    """
+    Detect stretches of speech in a sequence of frame energies.
+
+    :param ratio: Position of the threshold between noise floor and peak level.
+    :param min_pause: Minimal length in seconds of a pause between words.
+    :param min_length: Minimal length in seconds of a word.
+    :return: Pair of `numpy.ndarray`s with start and end frames of the detected words.
+    """
+    if not len(db):
+        return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+    smoothed = numpy.convolve(db, numpy.ones(5) / 5, mode='same')
+    floor, peak = numpy.percentile(smoothed, [10, 99])
+    voiced = smoothed > floor + ratio * (peak - floor)
+    edges = numpy.diff(numpy.concatenate([[0], voiced.astype(numpy.int8), [0]]))
+    starts, ends = numpy.flatnonzero(edges == 1), numpy.flatnonzero(edges == -1)
+    if len(starts):
+        # Close pauses which are too short to separate words:
+        keep = (starts[1:] - ends[:-1]) >= min_pause / hop
+        starts = numpy.concatenate([starts[:1], starts[1:][keep]])
+        ends = numpy.concatenate([ends[:-1][keep], ends[-1:]])
+        # Drop clicks and other short noise:
+        long = (ends - starts) >= min_length / hop
+        starts, ends = starts[long], ends[long]
+    return starts, ends
+
+
+def fit(starts, ends, db, n):
+    """
+    Adapt detected words to the expected number `n`, merging words across the shortest pauses or
+    splitting the longest words at their quietest frame.
+    """
+    if len(starts) > n:
+        merge = numpy.sort(numpy.argsort(starts[1:] - ends[:-1], kind='stable')[:len(starts) - n])
+        starts, ends = numpy.delete(starts, merge + 1), numpy.delete(ends, merge)
+    while 0 < len(starts) < n:
+        i = int(numpy.argmax(ends - starts))
+        if ends[i] - starts[i] < 3:
+            break
+        cut = starts[i] + 1 + int(numpy.argmin(db[starts[i] + 1:ends[i] - 1]))
+        starts, ends = numpy.insert(starts, i + 1, cut), numpy.insert(ends, i, cut)
+    if len(starts) != n:
+        raise ValueError('Could not detect {} words'.format(n))
+    return starts, ends
+
+
+def segment(path, n, hop=0.01, **kw):
+    """
+    Detect `n` words in an audio file.
+
+    :return: `tuple` of a `list` of `(start, end)` offsets in seconds and a `bool` flag \
+    signaling whether the number of detected words matched `n` without fitting.
+    """
+    db = frame_energy(path, hop=hop)
+    starts, ends = detect_words(db, hop=hop, **kw)
+    exact = len(starts) == n
+    starts, ends = fit(starts, ends, db, n)
+    return [(round(s * hop, 3), round(e * hop, 3)) for s, e in zip(starts, ends)], exact
+
+
+class Clips:
+    """
+    Access to the word clips of recordings, stored per language in raw/clips/.
+    """
+    def __init__(self, ds):
+        self.ds = ds
+        self._data = {}
+        self._changed = set()
+        self._store = None
+
+    def _language(self, rid):
+        lid = rid.rpartition('-')[0]
+        if lid not in self._data:
+            p = self.ds.clips_dir / '{}.json'.format(lid)
+            self._data[lid] = load(p) if p.exists() else {}
+        return self._data[lid]
+
+    def __getitem__(self, rid):
+        return self._language(rid)[rid]
+
+    def __setitem__(self, rid, clips):
+        self._language(rid)[rid] = clips
+        self._changed.add(rid.rpartition('-')[0])
+
+    def __contains__(self, rid):
+        return rid in self._language(rid)
+
+    def save(self):
+        for lid in sorted(self._changed):
+            dump(
+                {rid: self._data[lid][rid] for rid in sorted(self._data[lid])},
+                self.ds.clips_dir / '{}.json'.format(lid),
+                indent=2)
+        self._changed = set()
+
+    def offsets(self, rid):
+        """
+        :return: `dict` mapping form IDs to `(start, end)` offsets in seconds.
+        """
+        if rid not in self:
+            return {}
+        return {fid: (start, end) for fid, start, end in self[rid]['forms']}
+
+    def read(self, rid, form_id):
+        """
+        Read the audio of one word from the WAV file of a recording, downloading the file if
+        necessary.
+
+        The samples are read from a memory map of the file, i.e. only the frames of the clip are
+        read from disk.
+
+        :return: `tuple` of a `numpy.ndarray` with the audio data and the sample rate.
+        """
+        start, end = self.offsets(rid)[form_id]
+        mid = self[rid]['media'].replace('.', '_')
+        if self._store is None:
+            self._store = MediaStore(self.ds)
+        if mid not in self._store:
+            download(self.ds, recording=rid, suffix='wav', workers=1)
+        return self._store.seconds(mid, start, end), self._store.info(mid)['wav']['sample_rate']
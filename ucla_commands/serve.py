@@ -0,0 +1,247 @@
+"""
+Serve the CLDF data - and downloaded media files - via HTTP, from a local, read-only server.
+
+The CLDF data is loaded once and indexed in memory, so queries are answered without re-reading
+the CSV files. Responses are JSON, except for `/media/<MEDIA_ID>`, which streams the content of a
+downloaded (or packaged) media file - supporting HTTP Range requests - or redirects to the
+`Download_URL` if the file is not available locally.
+
+Endpoints:
+- /languages
+- /languages/<LANGUAGE_ID> - including IDs of the language's recordings
+- /forms?language=<LANGUAGE_ID>&parameter=<PARAMETER_ID>
+- /parameters/<PARAMETER_ID> - including the forms for the concept
+- /recordings/<RECORDING_ID> - including linked media, forms and word clips
+- /texts/<RECORDING_ID> - the examples transcribing the recording of a text
+- /media/<MEDIA_ID>
+"""
+import re
+import json
+import inspect
+import pathlib
+import decimal
+import functools
+import collections
+import urllib.parse
+import http.server
+
+from cldfbench_uclaphoneticslabarchive import Dataset
+from .mediastore import MediaStore
+from .packagemedia import MediaZips
+
+CHUNK = 1024 * 1024
+
+
+def register(parser):
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=1024,
+        help='Maximal number of JSON responses to keep in the LRU cache.')
+    parser.add_argument(
+        '--zips',
+        type=pathlib.Path,
+        default=None,
+        help='Directory with media packaged by `ucla.packagemedia`, to serve media files from, '
+             'which have not been downloaded to raw/media/.')
+
+
+def run(args):
+    ds = Dataset()
+    data = Data(ds.cldf_reader())
+    args.log.info('Loaded {} languages, {} forms, {} recordings'.format(
+        len(data.languages), len(data.forms), len(data.recordings)))
+    server = http.server.ThreadingHTTPServer(
+        (args.host, args.port),
+        handler(data, MediaStore(ds), MediaZips(args.zips) if args.zips else None, args))
+    args.log.info('Serving on http://{}:{}/'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:  # pragma: no cover
+        pass
+    finally:
+        server.server_close()
+
+
+def serialize(v):
+    if isinstance(v, decimal.Decimal):
+        return float(v)
+    if hasattr(v, 'unsplit'):  # URLs are read as `rfc3986.URIReference`.
+        return v.unsplit()
+    return str(v)
+
+
+def to_json(obj):
+    return json.dumps(obj, ensure_ascii=False, default=serialize).encode('utf8')
+
+
+class Data:
+    """
+    The CLDF data, indexed for the queries answered by the server.
+    """
+    def __init__(self, cldf):
+        def rows(table):
+            return collections.OrderedDict(
+                (row['ID'], row) for row in (cldf[table] if table in cldf else []))
+
+        self.languages = rows('LanguageTable')
+        self.parameters = rows('ParameterTable')
+        self.forms = rows('FormTable')
+        self.examples = rows('ExampleTable')
+        self.recordings = rows('ContributionTable')
+        self.media = rows('MediaTable')
+        self.clips = collections.defaultdict(list)
+        for row in rows('clips.csv').values():
+            self.clips[row['Contribution_ID']].append(row)
+        self.forms_by_language = collections.defaultdict(list)
+        self.forms_by_parameter = collections.defaultdict(list)
+        for row in self.forms.values():
+            self.forms_by_language[row['Language_ID']].append(row)
+            self.forms_by_parameter[row['Parameter_ID']].append(row)
+        self.recordings_by_language = collections.defaultdict(list)
+        for row in self.recordings.values():
+            self.recordings_by_language[row['Language_ID']].append(row['ID'])
+        self.routes = [
+            (re.compile(r'/languages/?$'), self.get_languages),
+            (re.compile(r'/languages/(?P<id>[^/]+)$'), self.get_language),
+            (re.compile(r'/forms/?$'), self.get_forms),
+            (re.compile(r'/parameters/(?P<id>[^/]+)$'), self.get_parameter),
+            (re.compile(r'/recordings/(?P<id>[^/]+)$'), self.get_recording),
+            (re.compile(r'/texts/(?P<id>[^/]+)$'), self.get_text),
+        ]
+
+    def query(self, path, query=''):
+        """
+        :return: JSON response as `bytes`.
+        :raises KeyError: if there is no matching object - or the query is not supported.
+        """
+        for pattern, func in self.routes:
+            m = pattern.match(path)
+            if m:
+                params = {k: v[0] for k, v in urllib.parse.parse_qs(query).items()}
+                if set(params) - set(inspect.signature(func).parameters):
+                    raise KeyError(query)
+                return to_json(func(*[urllib.parse.unquote(v) for v in m.groups()], **params))
+        raise KeyError(path)
+
+    def get_languages(self):
+        return list(self.languages.values())
+
+    def get_language(self, id_):
+        return dict(self.languages[id_], recordings=self.recordings_by_language[id_])
+
+    def get_forms(self, language=None, parameter=None):
+        if language and parameter:
+            return [f for f in self.forms_by_language.get(language, [])
+                    if f['Parameter_ID'] == parameter]
+        if language:
+            return self.forms_by_language.get(language, [])
+        if parameter:
+            return self.forms_by_parameter.get(parameter, [])
+        raise KeyError('language or parameter must be specified')
+
+    def get_parameter(self, id_):
+        return dict(self.parameters[id_], forms=self.forms_by_parameter[id_])
+
+    def get_recording(self, id_):
+        rec = self.recordings[id_]
+        return dict(
+            rec,
+            media=[self.media[mid] for mid in rec['Media_IDs'] if mid in self.media],
+            forms=[self.forms[fid] for fid in rec['Form_IDs'] if fid in self.forms],
+            clips=self.clips.get(id_, []))
+
+    def get_text(self, id_):
+        rec = self.recordings[id_]
+        if not rec['Text_IDs']:
+            raise KeyError(id_)
+        return dict(
+            recording=id_, examples=[self.examples[eid] for eid in rec['Text_IDs']])
+
+
+def parse_range(header, size):
+    """
+    Parse a single byte range of an HTTP Range header.
+
+    :return: `(start, stop)` pair, `None` for a header we don't support - i.e. the full content is \
+    sent - or raise `ValueError` for an unsatisfiable range.
+    """
+    m = re.fullmatch(r'bytes=(?P<start>[0-9]*)-(?P<end>[0-9]*)', header.strip())
+    if not m or not (m.group('start') or m.group('end')):
+        return None
+    if not m.group('start'):  # Suffix range, i.e. the last n bytes:
+        start, stop = max(size - int(m.group('end')), 0), size
+    else:
+        start = int(m.group('start'))
+        stop = min(int(m.group('end')) + 1, size) if m.group('end') else size
+    if start >= size or stop <= start:
+        raise ValueError(header)
+    return start, stop
+
+
+def handler(data, store, zips, args):
+    query = functools.lru_cache(maxsize=args.cache_size)(data.query)
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, fmt, *a):
+            args.log.debug(fmt % a)
+
+        def do_HEAD(self):
+            self.do_GET(body=False)
+
+        def do_GET(self, body=True):
+            url = urllib.parse.urlsplit(self.path)
+            if url.path.startswith('/media/'):
+                return self.send_media(urllib.parse.unquote(url.path[7:]), body)
+            try:
+                res = query(url.path, url.query)
+            except KeyError:
+                return self.send_error(404)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(res)))
+            self.end_headers()
+            if body:
+                self.wfile.write(res)
+
+        def send_media(self, mid, body):
+            if mid not in data.media:
+                return self.send_error(404)
+            if mid in store:
+                content = store.bytes(mid)
+            elif zips and mid in zips:
+                content = zips.bytes(mid)
+            else:
+                self.send_response(302)
+                self.send_header('Location', serialize(data.media[mid]['Download_URL']))
+                self.send_header('Content-Length', '0')
+                return self.end_headers()
+
+            size, start, stop = len(content), 0, len(content)
+            try:
+                range_ = parse_range(self.headers.get('Range', ''), size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(size))
+                self.send_header('Content-Length', '0')
+                return self.end_headers()
+            if range_:
+                start, stop = range_
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, stop - 1, size))
+            else:
+                self.send_response(200)
+            self.send_header('Content-Type', data.media[mid]['Media_Type'])
+            self.send_header('Content-Length', str(stop - start))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+            if body:
+                try:
+                    for pos in range(start, stop, CHUNK):
+                        self.wfile.write(memoryview(content[pos:min(pos + CHUNK, stop)]))
+                except (BrokenPipeError, ConnectionResetError):  # The client stopped reading.
+                    pass
+
+    return Handler
@@ -0,0 +1,211 @@
+"""
+Create thumbnails and tiled image pyramids for the downloaded scans of word lists.
+
+Scans - in particular the uncompressed TIF files - are big. To view a part of a scan, it is
+enough to load the tiles covering this part at a suitable resolution. Pyramids are stored in
+raw/cache/tiles/, keyed by the SHA256 of the scan (and the tile format), and indexed by media ID
+in raw/cache/tiles/index.json.
+"""
+import os
+import shutil
+import hashlib
+import functools
+
+from PIL import Image
+from clldutils.jsonlib import dump, load
+
+from cldfbench_uclaphoneticslabarchive import Dataset
+from .index import Index, Pool, select
+from .mediastore import MediaStore
+
+SCANS = {'jpg', 'tif'}
+
+
+def register(parser):
+    parser.add_argument(
+        'recording',
+        nargs='*',
+        help='Recording ID, language ID or "all". Scans of the selected recordings must have been '
+             'downloaded before. If no recording is specified, all downloaded scans are processed.')
+    parser.add_argument(
+        '--format',
+        choices=['jpeg', 'webp'],
+        default='jpeg',
+        help='Image format of tiles and thumbnails.')
+    parser.add_argument(
+        '--tile-size',
+        type=int,
+        default=256,
+        help='Width and height of tiles in pixels.')
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=None,
+        help='Number of scans to process in parallel (default: number of CPUs).')
+
+
+def run(args):
+    ds = Dataset()
+    store = MediaStore(ds)
+    if args.recording:
+        index = Index(ds)
+        mids = {m['id'] for rid in select(index, args.recording) for m in index.media(rid)}
+    else:
+        mids = set(store.index)
+    mids = sorted(
+        mid for mid in mids if mid in store and mid.split('_')[-1].lower() in SCANS)
+
+    tiles = Tiles(ds)
+    # Pyramids of scans which have been removed from raw/media/ are pruned below:
+    removed = [mid for mid in tiles.index if mid not in store]
+    for mid in removed:
+        del tiles.index[mid]
+    if removed:
+        args.log.info('Removed {} scans from the tile index'.format(len(removed)))
+    todo = {}
+    for mid in mids:
+        info, pyramid = store.info(mid), tiles.index.get(mid)
+        if not (pyramid
+                and (pyramid['size'], pyramid['mtime']) == (info['size'], info['mtime'])
+                and (pyramid['format'], pyramid['tile_size']) == (args.format, args.tile_size)
+                and tiles.dir.joinpath(pyramid['dir']).exists()):
+            todo[mid] = info
+
+    build = functools.partial(
+        build_pyramid, cache_dir=tiles.dir, tile_size=args.tile_size, format_=args.format)
+    pool = Pool(args.log, workers=args.processes, processes=True)
+    try:
+        jobs = {mid: (store.dir / info['path'],) for mid, info in todo.items()}
+        for mid, res in pool.map(build, jobs):
+            tiles.index[mid] = dict(res, size=todo[mid]['size'], mtime=todo[mid]['mtime'])
+    finally:
+        tiles.save()
+    tiles.prune()
+    args.log.info('{} scans, {} pyramids created or updated'.format(
+        len(mids), len(todo) - len(pool.failed)))
+    pool.check('Building tile pyramids', len(todo))
+
+
+def sha256(p):
+    res = hashlib.sha256()
+    with p.open('rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            res.update(chunk)
+    return res.hexdigest()
+
+
+def build_pyramid(p, cache_dir, tile_size=256, format_='jpeg', quality=80):
+    """
+    Create a thumbnail and tiles for each resolution level of an image.
+
+    Level 0 is the full resolution, each following level halves width and height, until the image
+    fits into one tile. Tiles are stored as `<level>/<column>_<row>.<ext>` in a directory named
+    after the SHA256 of the image file and the tile format. If this directory exists, the image is
+    not processed again.
+
+    :return: `dict` describing the pyramid.
+    """
+    digest = sha256(p)
+    name = '{}-{}{}'.format(digest, format_, tile_size)
+    target = cache_dir / name
+    if target.joinpath('pyramid.json').exists():
+        return load(target / 'pyramid.json')
+
+    Image.MAX_IMAGE_PIXELS = None  # Scans may be big, but they are not decompression bombs.
+    ext = 'jpg' if format_ == 'jpeg' else format_
+    tmp = cache_dir / '{}.tmp-{}'.format(name, os.getpid())
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+
+    with Image.open(str(p)) as img:
+        # Bilevel, palette or 16 bit scans must be converted for JPEG and WebP.
+        if img.mode.startswith('I'):
+            img = img.convert('I').point(lambda v: v * (1 / 256))
+        img = img.convert('RGB' if img.mode in {'RGB', 'RGBA', 'P', 'CMYK', 'YCbCr'} else 'L')
+    res = dict(
+        sha256=digest,
+        dir=name,
+        width=img.width,
+        height=img.height,
+        tile_size=tile_size,
+        format=format_,
+        levels=[])
+    level = 0
+    while True:
+        ldir = tmp / str(level)
+        ldir.mkdir()
+        for x in range(0, img.width, tile_size):
+            for y in range(0, img.height, tile_size):
+                img.crop((x, y, min(x + tile_size, img.width), min(y + tile_size, img.height)))\
+                    .save(str(ldir / '{}_{}.{}'.format(x // tile_size, y // tile_size, ext)),
+                          format_, quality=quality)
+        res['levels'].append([img.width, img.height])
+        if img.width <= tile_size and img.height <= tile_size:
+            break
+        img = img.reduce(2)
+        level += 1
+    img.thumbnail((tile_size, tile_size))
+    img.save(str(tmp / 'thumbnail.{}'.format(ext)), format_, quality=quality)
+    dump(res, tmp / 'pyramid.json')
+    try:
+        tmp.rename(target)
+    except OSError:  # Another process created the same pyramid in the meantime.
+        shutil.rmtree(tmp)
+    return res
+
+
+class Tiles:
+    """
+    Access to the thumbnails and tiles of scans by media ID.
+    """
+    def __init__(self, ds):
+        self.dir = ds.cache_dir / 'tiles'
+        self.dir.mkdir(exist_ok=True)
+        self.index = load(self.dir / 'index.json') if self.dir.joinpath('index.json').exists() \
+            else {}
+
+    def save(self):
+        dump(self.index, self.dir / 'index.json')
+
+    def prune(self):
+        """
+        Remove pyramids which are no longer referenced from the index, e.g. after re-creating
+        pyramids in a different format or after removing scans.
+        """
+        dirs = {pyramid['dir'] for pyramid in self.index.values()}
+        for p in self.dir.iterdir():
+            if p.is_dir() and '.tmp-' not in p.name and p.name not in dirs:
+                shutil.rmtree(p)
+
+    def _path(self, mid, *comps):
+        pyramid = self.index[mid]
+        comps = list(comps)
+        comps[-1] += '.jpg' if pyramid['format'] == 'jpeg' else '.webp'
+        return self.dir.joinpath(pyramid['dir'], *comps)
+
+    def thumbnail(self, mid):
+        """
+        :return: Path of the thumbnail of a scan.
+        """
+        return self._path(mid, 'thumbnail')
+
+    def tile(self, mid, level, column, row):
+        """
+        :return: Path of a tile of a scan.
+        """
+        w, h = self.index[mid]['levels'][level]
+        size = self.index[mid]['tile_size']
+        if not (0 <= column * size < w and 0 <= row * size < h):
+            raise IndexError('No tile {}/{}_{} for {}'.format(level, column, row, mid))
+        return self._path(mid, str(level), '{}_{}'.format(column, row))
+
+    def level(self, mid, max_size):
+        """
+        :return: Index of the largest level of a scan whose width and height are at most \
+        `max_size`.
+        """
+        for i, (w, h) in enumerate(self.index[mid]['levels']):
+            if w <= max_size and h <= max_size:
+                return i
+        return len(self.index[mid]['levels']) - 1
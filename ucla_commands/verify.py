@@ -0,0 +1,161 @@
+"""
+Verify the media files downloaded to raw/media/, writing a manifest of their SHA256 digests.
+
+The manifest raw/media/manifest.csv lists path, size, modification time, SHA256 and media ID of
+each file. Files which have not changed since the last run - according to size and modification
+time - are not hashed again. Sizes are checked against etc/urls.json, and files with identical
+content are reported - and may be replaced with hardlinks to save space.
+
+The command fails if files could not be hashed, if sizes don't match, or if - when re-hashing all
+files with `--refresh` - the digest of a file changed although its size and modification time did
+not, i.e. if its content got corrupted.
+"""
+import os
+import csv
+import hashlib
+import collections
+
+from clldutils.jsonlib import load
+
+from cldfbench_uclaphoneticslabarchive import Dataset
+from .index import Pool
+from .mediastore import MediaStore
+
+FIELDS = ['path', 'size', 'mtime', 'sha256', 'ID']
+
+
+def register(parser):
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help="Number of files to hash in parallel")
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        default=False,
+        help="Hash all files, even if size and modification time did not change")
+    parser.add_argument(
+        '--hardlink',
+        action='store_true',
+        default=False,
+        help="Replace files with identical content by hardlinks to one copy")
+
+
+def run(args):
+    ds = Dataset()
+    store = MediaStore(ds)
+    path = store.dir / 'manifest.csv'
+    previous = read_manifest(path)
+    manifest = {} if args.refresh else dict(previous)
+
+    todo = {}
+    for mid, info in store.index.items():
+        entry = manifest.get(info['path'])
+        if not (entry and unchanged(entry, info)):
+            todo[info['path']] = dict(
+                path=info['path'], size=info['size'], mtime=info['mtime'], ID=mid)
+    manifest = {k: v for k, v in manifest.items() if k in {i['path'] for i in store.index.values()}}
+
+    pool, hashed = Pool(args.log, workers=args.workers), 0
+    try:
+        for p, digest in pool.map(sha256, {p: (store.dir / p,) for p in todo}):
+            hashed += 1
+            entry = previous.get(p)
+            if entry and unchanged(entry, todo[p]) and entry['sha256'] != digest:
+                # We keep the previous digest, so the file is reported until it is replaced.
+                pool.fail(p, 'Content changed: SHA256 {} instead of {}'.format(
+                    digest, entry['sha256']))
+                manifest[p] = entry
+            else:
+                manifest[p] = dict(todo[p], sha256=digest)
+    finally:
+        write_manifest(path, manifest)
+    args.log.info('Hashed {} of {} files'.format(hashed, len(manifest)))
+
+    urls = load(ds.etc_dir / 'urls.json')
+    for p, entry in sorted(manifest.items()):
+        expected = urls.get(p, [None, None, None])[1]
+        if expected is not None and expected != entry['size']:
+            pool.fail(p, 'Size mismatch: expected {}, got {}'.format(expected, entry['size']))
+
+    linked = 0
+    # Files which failed verification must not become the source of hardlinks:
+    for paths in duplicates({p: e for p, e in manifest.items() if p not in pool.failed}):
+        args.log.info('Identical content: {}'.format(' '.join(paths)))
+        if args.hardlink:
+            for p in paths[1:]:
+                linked += hardlink(store.dir / paths[0], store.dir / p)
+    if linked:
+        # Hardlinked files share the modification time of the first copy:
+        for p, entry in manifest.items():
+            entry['mtime'] = store.dir.joinpath(p).stat().st_mtime
+        write_manifest(path, manifest)
+        args.log.info('Replaced {} files by hardlinks'.format(linked))
+    pool.check('Verification', len(store.index))
+
+
+def unchanged(entry, info):
+    return (entry['size'], entry['mtime']) == (info['size'], info['mtime'])
+
+
+def sha256(p, buffer_size=4 * 1024 * 1024):
+    """
+    Compute the SHA256 digest of a file, reading it in large chunks into a re-used buffer. `hashlib`
+    releases the GIL while hashing, so files can be hashed in parallel in threads.
+    """
+    res, buffer = hashlib.sha256(), bytearray(buffer_size)
+    view = memoryview(buffer)
+    with p.open('rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            res.update(view[:n])
+    return res.hexdigest()
+
+
+def read_manifest(p):
+    res = {}
+    if p.exists():
+        with p.open(encoding='utf8', newline='') as f:
+            for row in csv.DictReader(f):
+                row.update(size=int(row['size']), mtime=float(row['mtime']))
+                res[row['path']] = row
+    return res
+
+
+def write_manifest(p, manifest):
+    tmp = p.parent / '{}.tmp'.format(p.name)
+    with tmp.open('w', encoding='utf8', newline='') as f:
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        for _, entry in sorted(manifest.items()):
+            writer.writerow({k: entry[k] for k in FIELDS})
+    os.replace(tmp, p)
+
+
+def duplicates(manifest):
+    """
+    :return: `list` of sorted lists of paths of files with identical content.
+    """
+    by_digest = collections.defaultdict(list)
+    for p, entry in manifest.items():
+        by_digest[entry['sha256']].append(p)
+    return sorted(sorted(paths) for paths in by_digest.values() if len(paths) > 1)
+
+
+def hardlink(src, target):
+    """
+    Replace `target` with a hardlink to `src`.
+
+    :return: `bool` signaling whether the file was replaced.
+    """
+    if os.path.samefile(src, target):
+        return False
+    tmp = target.parent / '{}.link'.format(target.name)
+    if tmp.exists():
+        tmp.unlink()
+    os.link(src, tmp)
+    os.replace(tmp, target)
+    return True